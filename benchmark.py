@@ -0,0 +1,223 @@
+###############################################################################
+# benchmark.py: throughput and memory benchmarks for the decoder and for a
+#               short end-to-end evolution, on synthetic instances.
+#
+# This code is released under LICENSE.md.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+###############################################################################
+
+import json
+import os
+import platform
+import tempfile
+import time
+import tracemalloc
+
+import docopt
+import numpy as np
+import pandas as pd
+
+from brkga_mp_ipr.enums import Sense
+
+from tsp_instance import TSPInstance, CATEGORIAS
+from tsp_decoder import TSPDecoder
+from tsp_brkga import BrkgaMpIprLote
+from tsp_config import carregar_configuracao
+
+###############################################################################
+
+USAGE = """
+Usage:
+  benchmark.py [--clientes=<lista>] [--grupos=<lista>] [--codificacoes=<lista>] [--lote=<n>]
+               [--repeticoes=<n>] [--config=<arquivo>]
+               [--clientes-evolucao=<n>] [--populacao=<n>] [--geracoes=<n>]
+               [--semente=<n>] [--saida=<arquivo>]
+  benchmark.py (-h | --help)
+
+Options:
+  --clientes=<lista>         Client counts of the decode benchmark
+                             [default: 1000,10000,100000,1000000].
+  --grupos=<lista>           Values of qtd_grupos [default: 2,4,8].
+  --codificacoes=<lista>     Encodings of the group genes [default: grupos].
+  --lote=<n>                 Chromosomes per decode_lote() call [default: 32].
+  --repeticoes=<n>           Timed repetitions of each measure [default: 3].
+  --config=<arquivo>         BRKGA configuration of the evolution benchmark
+                             [default: config.conf].
+  --clientes-evolucao=<n>    Clients of the evolution benchmark [default: 1000].
+  --populacao=<n>            Population size of the evolution benchmark
+                             [default: 50].
+  --geracoes=<n>             Generations of the evolution benchmark [default: 5].
+  --semente=<n>              Seed of instances and chromosomes [default: 0].
+  --saida=<arquivo>          JSON file with the results [default: benchmark.json].
+  -h --help                  Show this screen.
+"""
+
+###############################################################################
+
+def gerar_csv(qtd_clientes: int, filename: str, semente: int = 0):
+    """
+    Writes a synthetic instance with the columns of the real base, using the
+    same categories, plus an extra column that the loader must discard.
+    """
+    rng = np.random.default_rng(semente)
+    dados = {'Id_Cliente': np.arange(qtd_clientes)}
+    for coluna, categorias in CATEGORIAS.items():
+        dados[coluna] = rng.choice(list(categorias), qtd_clientes)
+    dados['Taxa'] = rng.choice([1.99, 2.49, 2.99, 3.49, 3.99], qtd_clientes)
+    dados['Nivel_Risco_Novo'] = rng.integers(0, 5, qtd_clientes)
+    #a efetivação cai com a taxa, para que os alfas tenham sinal
+    dados['Flag_Efet'] = (rng.random(qtd_clientes) < 0.9 - 0.15*dados['Taxa']).astype(int)
+    pd.DataFrame(dados).to_csv(filename, index=False)
+
+def carregar_instancia(qtd_clientes: int, diretorio: str, semente: int) -> TSPInstance:
+    filename = os.path.join(diretorio, f"sintetica_{qtd_clientes}.csv")
+    if not os.path.exists(filename):
+        gerar_csv(qtd_clientes, filename, semente)
+    instance = TSPInstance(filename, tamanho_bloco=200000)
+    instance.preparar()
+    return instance
+
+###############################################################################
+
+def medir(funcao, repeticoes: int) -> float:
+    """
+    Returns the best wall-clock time of the repetitions, in seconds.
+    """
+    melhor = float("inf")
+    for _ in range(repeticoes):
+        inicio = time.perf_counter()
+        funcao()
+        melhor = min(melhor, time.perf_counter() - inicio)
+    return melhor
+
+def pico_memoria(funcao) -> int:
+    """
+    Returns the peak of memory allocated while running funcao, in bytes.
+    """
+    tracemalloc.start()
+    try:
+        funcao()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+def benchmark_decode(instance: TSPInstance, qtd_grupos: int, codificacao: str,
+                     lote: int, repeticoes: int, semente: int) -> dict:
+    qtd_clientes = len(instance.df.index)
+
+    inicio = time.perf_counter()
+    decoder = TSPDecoder(instance, qtd_grupos, 5, codificacao=codificacao)
+    tempo_construcao = time.perf_counter() - inicio
+
+    rng = np.random.default_rng(semente)
+    cromossomos = rng.random((lote, decoder.tamanho_cromossomo))
+    cromossomo = cromossomos[0].tolist()
+
+    tempo_decode = medir(lambda: decoder.decode(cromossomo, False), repeticoes)
+    tempo_lote = medir(lambda: decoder.decode_lote(cromossomos), repeticoes)
+
+    return {
+        "clientes": qtd_clientes,
+        "qtd_grupos": qtd_grupos,
+        "codificacao": codificacao,
+        "tamanho_cromossomo": cromossomos.shape[1],
+        "construcao_s": tempo_construcao,
+        "decode_por_s": 1 / tempo_decode,
+        "decode_lote_por_s": lote / tempo_lote,
+        "pico_memoria_decode_bytes": pico_memoria(lambda: decoder.decode(cromossomo, False)),
+        "pico_memoria_decode_lote_bytes": pico_memoria(lambda: decoder.decode_lote(cromossomos)),
+    }
+
+def benchmark_evolucao(instance: TSPInstance, configuracao: str, populacao: int,
+                       geracoes: int, semente: int) -> dict:
+    brkga_params, _, _ = carregar_configuracao(configuracao)
+    brkga_params.population_size = populacao
+
+    decoder = TSPDecoder(instance, 4, 5)
+    brkga = BrkgaMpIprLote(
+        decoder=decoder,
+        sense=Sense.MINIMIZE,
+        seed=semente,
+        chromosome_size=decoder.tamanho_cromossomo,
+        params=brkga_params
+    )
+
+    inicio = time.perf_counter()
+    brkga.initialize()
+    tempo_inicializacao = time.perf_counter() - inicio
+
+    inicio = time.perf_counter()
+    brkga.evolve(geracoes)
+    tempo_evolucao = time.perf_counter() - inicio
+
+    return {
+        "clientes": len(instance.df.index),
+        "populacao": populacao,
+        "populacoes": brkga_params.num_independent_populations,
+        "geracoes": geracoes,
+        "inicializacao_s": tempo_inicializacao,
+        "geracoes_por_s": geracoes / tempo_evolucao,
+        "melhor_fitness": brkga.get_best_fitness(),
+    }
+
+###############################################################################
+
+def main() -> None:
+    args = docopt.docopt(USAGE)
+
+    clientes = [int(valor) for valor in args["--clientes"].split(",")]
+    grupos = [int(valor) for valor in args["--grupos"].split(",")]
+    codificacoes = args["--codificacoes"].split(",")
+    lote = int(args["--lote"])
+    repeticoes = int(args["--repeticoes"])
+    semente = int(args["--semente"])
+
+    resultados = {
+        "data": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "pandas": pd.__version__,
+        "maquina": platform.platform(),
+        "cpus": os.cpu_count(),
+        "decode": [],
+        "evolucao": None,
+    }
+
+    with tempfile.TemporaryDirectory() as diretorio:
+        for qtd_clientes in clientes:
+            instance = carregar_instancia(qtd_clientes, diretorio, semente)
+            for qtd_grupos in grupos:
+                for codificacao in codificacoes:
+                    print(f"Decode: {qtd_clientes} clients, {qtd_grupos} groups, {codificacao}...")
+                    resultado = benchmark_decode(instance, qtd_grupos, codificacao, lote, repeticoes, semente)
+                    print(f"  {resultado['decode_por_s']:.1f} decodes/s, "
+                          f"{resultado['decode_lote_por_s']:.1f} batch decodes/s")
+                    resultados["decode"].append(resultado)
+
+        qtd_clientes = int(args["--clientes-evolucao"])
+        print(f"Evolution: {qtd_clientes} clients...")
+        instance = carregar_instancia(qtd_clientes, diretorio, semente)
+        resultados["evolucao"] = benchmark_evolucao(
+            instance, args["--config"], int(args["--populacao"]),
+            int(args["--geracoes"]), semente)
+        print(f"  {resultados['evolucao']['geracoes_por_s']:.3f} generations/s")
+
+    with open(args["--saida"], "w") as hd:
+        json.dump(resultados, hd, indent=2)
+    print(f"Results written to {args['--saida']}")
+
+###############################################################################
+
+if __name__ == "__main__":
+    main()
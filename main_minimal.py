@@ -24,46 +24,195 @@
 ###############################################################################
 
 import sys
+import time
+
+import docopt
 
 from brkga_mp_ipr.enums import Sense
-from brkga_mp_ipr.types_io import load_configuration
-from brkga_mp_ipr.algorithm import BrkgaMpIpr
 
 from tsp_instance import TSPInstance
-from tsp_decoder import TSPDecoder
+from tsp_decoder import TSPDecoder, CODIFICACOES, CODIFICACAO_GRUPOS, TIPOS_GENE
+from tsp_brkga import BrkgaMpIprLote, CriterioParada
+from tsp_config import carregar_configuracao
+from tsp_paralelo import DecoderParalelo
+from tsp_cache import CacheFitness
+from tsp_ilhas import ExecucaoIlhas
+from tsp_checkpoint import gravar_checkpoint, ler_checkpoint
+from tsp_heuristica import gerar_cromossomos
+from tsp_amostragem import DecoderAmostral
+from tsp_telemetria import Telemetria, Eventos
+from tsp_perfil import Perfil, perfil_ativo, perfil_memoria
 
 ###############################################################################
 
+USAGE = """
+Usage:
+  main_minimal.py <seed> <config-file> <num-generations> <tsp-instance-file>
+                  [--processos=<n>] [--sem-cache] [--cache-fitness=<mb>]
+                  [--perfil] [--codificacao=<tipo>] [--comprimir] [--ilhas]
+                  [--checkpoint=<n>] [--resume] [--tempo=<s>]
+                  [--sem-melhora=<n>] [--alvo=<fitness>] [--reparar]
+                  [--amostra=<fracao>] [--telemetria=<n>]
+                  [--armazenamento=<tipo>] [--controle] [--incremental]
+  main_minimal.py (-h | --help)
+
+<num-generations> is the maximum number of generations; 0 removes the limit
+when another stopping criterion is given.
+
+Options:
+  --processos=<n>   Number of processes used to decode the populations.
+                    Overrides num_processos from <config-file> (default 1).
+  --sem-cache       Always parse the CSV and do not write the binary cache
+                    of the treated instance (<tsp-instance-file>.cache).
+  --cache-fitness=<mb>
+                    Memory limit of the fitness cache, in MB (0 disables it).
+                    Overrides cache_fitness_mb from <config-file>.
+  --perfil          Time each decode stage and print a summary at the end
+                    (same as setting TSP_PERFIL=1). TSP_PERFIL=memoria also
+                    reports the peak memory of each stage, tracing every
+                    allocation, which makes the run several times slower.
+                    Stages run inside worker processes are not measured.
+  --codificacao=<tipo>
+                    Group genes: "grupos" (qtd_grupos genes per client, cut at
+                    0.5), "compacta" (one gene per client, split into "no
+                    group" plus one range per group) or "chaves" (one such
+                    gene per key of the chosen mask, so clients with the same
+                    key always share a group). Overrides codificacao from
+                    <config-file> (default grupos).
+  --comprimir       Merge identical clients into one weighted row, so the
+                    group genes are per distinct row instead of per client.
+                    Overrides comprimir_clientes from <config-file>.
+  --ilhas           Evolve each independent population in its own process,
+                    exchanging elite individuals every exchange_interval
+                    generations (and resetting them every reset_interval
+                    generations with --controle). Each island decodes
+                    serially, so num_processos, --perfil, --amostra and the
+                    stopping criteria other than <num-generations> are
+                    ignored.
+                    Overrides ilhas from <config-file>.
+  --checkpoint=<n>  Save the evolution state to arquivo_checkpoint every <n>
+                    generations (0 disables it; not available with islands).
+                    Overrides intervalo_checkpoint from <config-file>.
+  --resume          Continue from arquivo_checkpoint up to <num-generations>
+                    in total, on the same trajectory as an uninterrupted run
+                    with the same seed and parameters.
+  --tempo=<s>       Stop after <s> seconds of evolution. Overrides
+                    tempo_maximo from <config-file>.
+  --sem-melhora=<n> Stop after <n> generations without improving the best
+                    solution. Overrides geracoes_sem_melhora.
+  --alvo=<fitness>  Stop when the best fitness reaches <fitness>. Overrides
+                    fitness_alvo.
+  --reparar         Repair every decoded chromosome in place (whole keys in
+                    one group, no client left out) and renumber its groups
+                    in a canonical order. Overrides reparar.
+  --amostra=<fracao>
+                    Start evaluating on this fraction of the rows, sampled
+                    by Taxa and Flag_Efet, growing it as configured by
+                    geracoes_por_amostra and amostra_sem_melhora. The
+                    populations are evaluated on the whole base before the
+                    best cost is reported. Overrides amostra_inicial.
+  --telemetria=<n>  Append one JSON line to arquivo_telemetria every <n>
+                    generations, with the best and mean fitness and the
+                    diversity of each population, the time per generation,
+                    the decodes and the exchanges and resets done since the
+                    previous line (0 disables it; not available with
+                    islands). Overrides intervalo_telemetria.
+  --armazenamento=<tipo>
+                    Type of the population genes: "float64", "float32" (half
+                    the memory), "uint16" or "uint8" (keys quantized to 2**16
+                    or 256 levels, a quarter or an eighth of the memory). The
+                    decoder reads them directly. Overrides
+                    armazenamento_populacao from <config-file>.
+  --controle        Exchange the best individuals among the populations
+                    every exchange_interval generations and rebuild them
+                    with new keys, keeping only the best individual, every
+                    reset_interval generations. Overrides
+                    controle_populacoes from <config-file>.
+  --incremental     Evaluate each crossover child from the parent that gave
+                    it most genes, updating the parent's count tables only
+                    for the genes that changed. Only with the "grupos"
+                    encoding, without --reparar or --amostra; islands
+                    ignore it. Overrides avaliacao_incremental.
+  -h --help         Show this screen.
+"""
+
 def main() -> None:
-    if len(sys.argv) < 4:
-        print("Usage: python main_minimal.py <seed> <config-file> "
-              "<num-generations> <tsp-instance-file>")
-        sys.exit(1)
+    args = docopt.docopt(USAGE)
 
     ########################################
     # Read the command-line arguments and the instance
     ########################################
 
-    seed = int(sys.argv[1])
-    configuration_file = sys.argv[2]
-    num_generations = int(sys.argv[3])
-    instance_file = sys.argv[4]
-
-    print("Reading data...")
-    instance = TSPInstance(instance_file)
-
-    colunas_selecionadas = ['Compr_Renda', 'Nivel_Escolaridade', 'Taxa', 'Estado_Civil', 'Regiao', 'Flag_Efet', 'Nivel_Risco_Novo']
-    colunas_removidas = [col for col in instance.df.columns if col not in colunas_selecionadas]
-    instance.df.drop(colunas_removidas, axis=1, inplace=True)
-    instance.tratamento_dados()
-    instance.df_original = instance.df.copy()
+    seed = int(args["<seed>"])
+    configuration_file = args["<config-file>"]
+    num_generations = int(args["<num-generations>"])
+    instance_file = args["<tsp-instance-file>"]
 
     ########################################
     # Read algorithm parameters
     ########################################
 
     print("Reading parameters...")
-    brkga_params, _ = load_configuration(configuration_file)
+    brkga_params, control_params, parametros = carregar_configuracao(configuration_file)
+    if args["--processos"] is not None:
+        parametros.num_processos = int(args["--processos"])
+    if args["--cache-fitness"] is not None:
+        parametros.cache_fitness_mb = int(args["--cache-fitness"])
+    if args["--codificacao"] is not None:
+        parametros.codificacao = args["--codificacao"]
+    if parametros.codificacao not in CODIFICACOES:
+        print(f"Unknown encoding: {parametros.codificacao} "
+              f"(use {', '.join(CODIFICACOES)})")
+        sys.exit(1)
+    if args["--sem-cache"]:
+        parametros.cache_instancia = False
+    if args["--comprimir"]:
+        parametros.comprimir_clientes = True
+    if args["--ilhas"]:
+        parametros.ilhas = True
+    if args["--checkpoint"] is not None:
+        parametros.intervalo_checkpoint = int(args["--checkpoint"])
+    if args["--tempo"] is not None:
+        parametros.tempo_maximo = float(args["--tempo"])
+    if args["--sem-melhora"] is not None:
+        parametros.geracoes_sem_melhora = int(args["--sem-melhora"])
+    if args["--alvo"] is not None:
+        parametros.fitness_alvo = float(args["--alvo"])
+    if args["--reparar"]:
+        parametros.reparar = True
+    if args["--controle"]:
+        parametros.controle_populacoes = True
+    if args["--incremental"]:
+        parametros.avaliacao_incremental = True
+    if args["--amostra"] is not None:
+        parametros.amostra_inicial = float(args["--amostra"])
+    if args["--telemetria"] is not None:
+        parametros.intervalo_telemetria = int(args["--telemetria"])
+    if args["--armazenamento"] is not None:
+        parametros.armazenamento_populacao = args["--armazenamento"]
+    if parametros.armazenamento_populacao not in TIPOS_GENE:
+        print(f"Unknown population storage: {parametros.armazenamento_populacao} "
+              f"(use {', '.join(TIPOS_GENE)})")
+        sys.exit(1)
+    if parametros.avaliacao_incremental and (parametros.codificacao != CODIFICACAO_GRUPOS or
+                                             parametros.reparar or parametros.amostra_inicial < 1):
+        print("The incremental evaluation needs the \"grupos\" encoding, without repair or sampling")
+        sys.exit(1)
+
+    criterio = CriterioParada(num_generations, parametros.tempo_maximo,
+                              parametros.geracoes_sem_melhora, parametros.fitness_alvo)
+    if not criterio.limitado:
+        print("No stopping criterion: give <num-generations> > 0, a time budget, "
+              "a stall limit or a target fitness")
+        sys.exit(1)
+
+    print("Reading data...")
+    instance = TSPInstance(instance_file, usar_cache=parametros.cache_instancia,
+                           tamanho_bloco=parametros.tamanho_bloco_csv)
+    instance.preparar()
+    if parametros.comprimir_clientes:
+        qtd_clientes = instance.comprimir()
+        print(f"Compressed {qtd_clientes} clients into {len(instance.df.index)} distinct rows")
 
     ########################################
     # Build the BRKGA data structures and initialize
@@ -71,31 +220,205 @@ def main() -> None:
 
     print("Building BRKGA data and initializing...")
 
-    decoder = TSPDecoder(instance, 4, 5)
-    instance.num_nodes = 4*len(instance.df.index)+5
+    decoder = TSPDecoder(instance, parametros.qtd_grupos, 5, codificacao=parametros.codificacao)
+    instance.num_nodes = decoder.tamanho_cromossomo
 
-    brkga = BrkgaMpIpr(
-        decoder=decoder,
-        sense=Sense.MINIMIZE,
-        seed=seed,
-        chromosome_size=instance.num_nodes,
-        params=brkga_params
-    )
+    iniciais = []
+    quantidade_inicial = int(parametros.fracao_heuristica * brkga_params.population_size)
+    if quantidade_inicial > 0 and not args["--resume"]:
+        print(f"Building {quantidade_inicial} warm-start solutions...")
+        iniciais = gerar_cromossomos(decoder, quantidade_inicial, seed)
 
+    if parametros.ilhas:
+        if args["--resume"]:
+            print("Checkpoints are not available with islands")
+            sys.exit(1)
+        if num_generations <= 0:
+            print("Islands stop only by <num-generations>")
+            sys.exit(1)
+        evoluir_ilhas(decoder, brkga_params, control_params, parametros, seed, num_generations, iniciais)
+        return
 
+    perfil = None
+    if args["--perfil"] or perfil_ativo():
+        decoder.perfil = perfil = Perfil(perfil_memoria())
 
-    # NOTE: don't forget to initialize the algorithm.
-    brkga.initialize()
+    #os filhos são avaliados em série pelo decoder da base, fora do cache e dos processos
+    incremental = decoder if parametros.avaliacao_incremental else None
 
-    ########################################
-    # Find good solutions / evolve
-    ########################################
+    paralelo = None
+    if parametros.num_processos > 1:
+        print(f"Decoding with {parametros.num_processos} processes...")
+        decoder = paralelo = DecoderParalelo(decoder, parametros.num_processos)
+
+    amostral = None
+    if parametros.amostra_inicial < 1:
+        try:
+            decoder = amostral = DecoderAmostral(decoder, parametros.amostra_inicial, seed)
+        except ValueError as e:
+            print(f"Cannot sample: {e}")
+            sys.exit(1)
+
+    cache = None
+    if parametros.cache_fitness_mb > 0:
+        decoder = cache = CacheFitness(decoder, parametros.cache_fitness_mb)
+
+    telemetria = None
+    if parametros.intervalo_telemetria > 0:
+        telemetria = Telemetria(parametros.arquivo_telemetria)
+
+    try:
+        brkga = BrkgaMpIprLote(
+            decoder=decoder,
+            sense=Sense.MINIMIZE,
+            seed=seed,
+            chromosome_size=instance.num_nodes,
+            params=brkga_params,
+            reescrever=parametros.reparar,
+            armazenamento=parametros.armazenamento_populacao,
+            incremental=incremental
+        )
+
+        geracao = 0
+        ultima_melhora = None
+        if args["--resume"]:
+            print(f"Resuming from {parametros.arquivo_checkpoint}...")
+            try:
+                cabecalho = ler_checkpoint(parametros.arquivo_checkpoint, brkga, seed)
+            except (OSError, ValueError) as e:
+                print(f"Cannot resume: {e}")
+                sys.exit(1)
+            geracao = cabecalho["geracao"]
+            ultima_melhora = cabecalho.get("ultima_melhora")
+            if amostral is not None:
+                amostral.definir_fracao(cabecalho.get("fracao_amostra", 1.0))
+            print(f"Resumed at generation {geracao}")
+        else:
+            if iniciais:
+                brkga.set_initial_population(iniciais)
+            # NOTE: don't forget to initialize the algorithm.
+            brkga.initialize()
+
+        ########################################
+        # Find good solutions / evolve
+        ########################################
+
+        #evolui uma geração por vez, verificando as condições de parada entre elas;
+        #a sequência de gerações é a mesma de um evolve() só
+        intervalo = parametros.intervalo_checkpoint
+        criterio.iniciar(geracao, brkga.get_best_fitness(), ultima_melhora)
+        geracao_inicial = geracao
+        decodificacoes_iniciais = brkga.decodificacoes
+        eventos = Eventos()
+        marco_geracao = geracao
+        marco_tempo = criterio.inicio
+
+        if amostral is not None:
+            print(f"Evaluating on {amostral.fracao:.1%} of the rows ({amostral.qtd_linhas})...")
+
+        print("Evolving...")
+        while True:
+            motivo = criterio.motivo()
+            if motivo is not None:
+                #o alvo e a estagnação só valem na base inteira: numa amostra, ela passa a ser a base inteira
+                if amostral is None or amostral.completa or criterio.esgotado():
+                    break
+                aumentar_amostra(amostral, brkga, cache, criterio, completa=True)
+                continue
+            brkga.evolve(1)
+            geracao += 1
+            if parametros.controle_populacoes:
+                brkga.controlar(geracao, control_params, eventos.medir)
+            criterio.atualizar(geracao, brkga.get_best_fitness())
+            if amostral is not None and not amostral.completa:
+                agendada = parametros.geracoes_por_amostra > 0 and geracao % parametros.geracoes_por_amostra == 0
+                estagnada = parametros.amostra_sem_melhora > 0 and \
+                    geracao - criterio.ultima_melhora >= parametros.amostra_sem_melhora
+                if agendada or estagnada:
+                    aumentar_amostra(amostral, brkga, cache, criterio)
+            if intervalo > 0 and geracao % intervalo == 0:
+                extras = {"ultima_melhora": criterio.ultima_melhora}
+                if amostral is not None:
+                    extras["fracao_amostra"] = amostral.fracao
+                gravar_checkpoint(parametros.arquivo_checkpoint, brkga, seed, geracao, **extras)
+            if telemetria is not None and geracao % parametros.intervalo_telemetria == 0:
+                agora = time.perf_counter()
+                registro = {
+                    "geracao": geracao,
+                    "tempo_s": agora - criterio.inicio,
+                    "tempo_por_geracao_s": (agora - marco_tempo) / (geracao - marco_geracao),
+                    "decodificacoes": brkga.decodificacoes,
+                    "melhor": brkga.get_best_fitness(),
+                    "populacoes": brkga.estatisticas(),
+                    **eventos.resumo(),
+                }
+                if amostral is not None:
+                    registro["fracao_amostra"] = amostral.fracao
+                telemetria.registrar(registro)
+                eventos.zerar()
+                marco_geracao = geracao
+                marco_tempo = time.perf_counter()
+
+        tempo = time.perf_counter() - criterio.inicio
+        geracoes = geracao - geracao_inicial
+        decodificacoes = brkga.decodificacoes - decodificacoes_iniciais
+        print(f"Stopped at generation {geracao}: {motivo}")
+        print(f"Evolved {geracoes} generations in {tempo:.2f} s: "
+              f"{geracoes / tempo if tempo > 0 else 0.0:.3f} generations/s, "
+              f"{decodificacoes / tempo if tempo > 0 else 0.0:.1f} decodes/s")
+
+        #o melhor custo informado é sempre o da base inteira
+        if amostral is not None and not amostral.completa:
+            aumentar_amostra(amostral, brkga, cache, criterio, completa=True)
+
+        best_cost = brkga.get_best_fitness()
+        print(f"Best cost: {best_cost}")
+
+        if cache is not None:
+            print(cache.resumo())
+
+    finally:
+        if telemetria is not None:
+            telemetria.fechar()
+        if amostral is not None:
+            amostral.fechar()
+        if paralelo is not None:
+            paralelo.fechar()
+        if perfil is not None:
+            print("Decoder profile:")
+            print(perfil.tabela())
+
+def aumentar_amostra(amostral: DecoderAmostral, brkga: BrkgaMpIprLote, cache: CacheFitness,
+                     criterio: CriterioParada, completa: bool = False) -> None:
+    #cresce a amostra (ou passa à base inteira); os fitness da fração anterior não são comparáveis:
+    #esvazia o cache e reavalia as populações
+    if completa:
+        amostral.definir_fracao(1.0)
+    else:
+        amostral.crescer()
+    if cache is not None:
+        cache.limpar()
+    brkga.reavaliar()
+    criterio.redefinir(criterio.geracao, brkga.get_best_fitness())
+    print(f"Generation {criterio.geracao}: evaluating on {amostral.fracao:.1%} of the rows "
+          f"({amostral.qtd_linhas}), best cost {criterio.melhor}")
 
-    print(f"Evolving {num_generations} generations...")
-    brkga.evolve(num_generations)
+def evoluir_ilhas(decoder: TSPDecoder, brkga_params, control_params, parametros,
+                  seed: int, num_generations: int, iniciais: list) -> None:
+    print(f"Starting {brkga_params.num_independent_populations} islands...")
+    with ExecucaoIlhas(decoder, brkga_params, Sense.MINIMIZE, seed,
+                       parametros.cache_fitness_mb, iniciais, parametros.reparar,
+                       parametros.armazenamento_populacao) as ilhas:
+        print(f"Evolving {num_generations} generations...")
+        ilhas.evoluir(num_generations, control_params.exchange_interval,
+                      control_params.num_exchange_indivuduals,
+                      control_params.reset_interval if parametros.controle_populacoes else 0)
+        best_cost, _, resumos = ilhas.melhor()
 
-    best_cost = brkga.get_best_fitness()
     print(f"Best cost: {best_cost}")
+    for ilha, resumo in enumerate(resumos):
+        if resumo is not None:
+            print(f"Island {ilha}: {resumo}")
 
 ###############################################################################
 
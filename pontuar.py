@@ -0,0 +1,202 @@
+###############################################################################
+# pontuar.py: scores group assignments produced elsewhere (previous runs,
+#             analyst proposals) against an instance, streaming them in
+#             batches through the decoder fitness.
+#
+# This code is released under LICENSE.md.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+###############################################################################
+
+import csv
+import sys
+import time
+
+import docopt
+import numpy as np
+
+from brkga_mp_ipr.exceptions import LoadError
+
+from tsp_instance import TSPInstance
+from tsp_decoder import TSPDecoder, COLUNAS_VARIAVEIS, CODIFICACAO_COMPACTA
+from tsp_config import carregar_configuracao
+
+###############################################################################
+
+USAGE = """
+Usage:
+  pontuar.py <config-file> <tsp-instance-file> <assignments-file>
+             [--lote=<n>] [--saida=<arquivo>]
+  pontuar.py (-h | --help)
+
+Options:
+  --lote=<n>          Assignments read and scored at a time [default: 256].
+  --saida=<arquivo>   CSV file with the fitness and its components of each
+                      assignment [default: pontuacao.csv].
+  -h --help           Show this screen.
+
+An assignment is a mask of the key variables plus the group of each row of
+the instance, in the order the loader keeps them (0 is no group, 1 to
+qtd_grupos from <config-file> are the groups). <assignments-file> is either:
+
+  - a text file with the header "solucao,mascara,grupos" and one assignment
+    per line: an identifier, the mask as one 0/1 digit per variable (in the
+    order Compr_Renda, Nivel_Escolaridade, Estado_Civil, Regiao,
+    Nivel_Risco_Novo) and the groups separated by spaces, as in
+        run7_best,10110,1 3 0 2 2 ...
+  - a .npy matrix (assignments x (5 + rows)) holding the mask digits and
+    then the groups, identified by their line number.
+
+Only one batch is in memory at a time, so any number of assignments can be
+scored. Each line of <arquivo> has the fitness, the spread of the sorted
+alphas and the penalties of clients without a group and of keys split among
+groups, which add up to the fitness. comprimir_clientes is ignored.
+"""
+
+#uma solução por linha, com estas colunas
+CABECALHO_SOLUCOES = ["solucao", "mascara", "grupos"]
+CAMPOS_SAIDA = ["solucao", "fitness", "dispersao_alfa", "penalidade_cliente", "penalidade_chave"]
+
+###############################################################################
+
+def ler_texto(filename: str, qtd_variaveis: int, qtd_clientes: int, qtd_grupos: int):
+    """
+    Gera (identificador, linha) para cada solução do arquivo texto, em que
+    linha é o vetor uint8 com a máscara e os grupos.
+
+    Raises:
+        LoadError: Se o cabeçalho ou alguma linha estiverem mal formados.
+    """
+    with open(filename) as hd:
+        cabecalho = hd.readline().strip().split(",")
+        if cabecalho != CABECALHO_SOLUCOES:
+            raise LoadError(f"{filename}: the header must be {','.join(CABECALHO_SOLUCOES)}")
+
+        for numero, texto in enumerate(hd, start=2):
+            if not texto.strip():
+                continue
+            campos = texto.rstrip("\n").split(",", 2)
+            if len(campos) != 3:
+                raise LoadError(f"{filename}:{numero}: expected {','.join(CABECALHO_SOLUCOES)}")
+            identificador, mascara, grupos = campos
+
+            mascara = mascara.strip()
+            if len(mascara) != qtd_variaveis or set(mascara) - {"0", "1"}:
+                raise LoadError(f"{filename}:{numero}: the mask must have {qtd_variaveis} 0/1 digits")
+            try:
+                grupos = np.array(grupos.split(), dtype=np.int64)
+            except ValueError:
+                raise LoadError(f"{filename}:{numero}: the groups must be integers") from None
+            if len(grupos) != qtd_clientes:
+                raise LoadError(f"{filename}:{numero}: {len(grupos)} groups for {qtd_clientes} rows")
+            if grupos.min() < 0 or grupos.max() > qtd_grupos:
+                raise LoadError(f"{filename}:{numero}: the groups must be between 0 and {qtd_grupos}")
+
+            linha = np.empty(qtd_variaveis + qtd_clientes, dtype=np.uint8)
+            linha[:qtd_variaveis] = [int(digito) for digito in mascara]
+            linha[qtd_variaveis:] = grupos
+            yield identificador.strip(), linha
+
+def ler_npy(filename: str, qtd_variaveis: int, qtd_clientes: int, qtd_grupos: int, lote: int):
+    """
+    Gera (identificadores, bloco) com até `lote` soluções da matriz .npy,
+    lida do disco por mmap, um bloco de cada vez.
+
+    Raises:
+        LoadError: Se a matriz tiver outro formato ou valores fora da faixa.
+    """
+    matriz = np.load(filename, mmap_mode="r")
+    if matriz.ndim != 2 or matriz.shape[1] != qtd_variaveis + qtd_clientes:
+        raise LoadError(f"{filename}: expected a matrix with {qtd_variaveis + qtd_clientes} columns, "
+                        f"got shape {matriz.shape}")
+
+    for inicio in range(0, len(matriz), lote):
+        bloco = np.asarray(matriz[inicio:inicio+lote])
+        if bloco.min(initial=0) < 0 or (bloco[:, :qtd_variaveis] > 1).any() or \
+                (bloco[:, qtd_variaveis:] > qtd_grupos).any():
+            raise LoadError(f"{filename}: values out of range in lines {inicio} to {inicio + len(bloco) - 1}")
+        yield [str(indice) for indice in range(inicio, inicio + len(bloco))], bloco.astype(np.uint8, copy=False)
+
+def blocos_texto(solucoes, lote: int):
+    #agrupa as soluções do arquivo texto em blocos de até `lote` linhas
+    identificadores = []
+    linhas = []
+    for identificador, linha in solucoes:
+        identificadores.append(identificador)
+        linhas.append(linha)
+        if len(linhas) == lote:
+            yield identificadores, np.stack(linhas)
+            identificadores = []
+            linhas = []
+    if linhas:
+        yield identificadores, np.stack(linhas)
+
+###############################################################################
+
+def main() -> None:
+    args = docopt.docopt(USAGE)
+    lote = int(args["--lote"])
+    solucoes_file = args["<assignments-file>"]
+
+    print("Reading parameters...")
+    try:
+        _, _, parametros = carregar_configuracao(args["<config-file>"])
+    except LoadError as e:
+        print(f"Error: {e}")
+        sys.exit(1)
+    if lote < 1:
+        print("Error: --lote must be positive")
+        sys.exit(1)
+
+    print("Reading data...")
+    instance = TSPInstance(args["<tsp-instance-file>"], usar_cache=parametros.cache_instancia,
+                           tamanho_bloco=parametros.tamanho_bloco_csv)
+    instance.preparar()
+
+    #a codificação compacta discretizada é exatamente a máscara e o grupo de cada linha
+    qtd_variaveis = len(COLUNAS_VARIAVEIS)
+    decoder = TSPDecoder(instance, parametros.qtd_grupos, qtd_variaveis, codificacao=CODIFICACAO_COMPACTA)
+    argumentos = (solucoes_file, qtd_variaveis, decoder.qtd_clientes, parametros.qtd_grupos)
+    if solucoes_file.endswith(".npy"):
+        blocos = ler_npy(*argumentos, lote)
+    else:
+        blocos = blocos_texto(ler_texto(*argumentos), lote)
+
+    print(f"Scoring {solucoes_file}...")
+    inicio = time.perf_counter()
+    quantidade = 0
+    try:
+        with open(args["--saida"], "w", newline="") as hd:
+            escritor = csv.writer(hd)
+            escritor.writerow(CAMPOS_SAIDA)
+            for identificadores, bloco in blocos:
+                componentes = decoder.componentes_discretos(bloco)
+                fitness = componentes[:, 0] + componentes[:, 1] + componentes[:, 2]
+                escritor.writerows([identificador, valor, *parcelas]
+                                   for identificador, valor, parcelas
+                                   in zip(identificadores, fitness.tolist(), componentes.tolist()))
+                hd.flush()
+                quantidade += len(bloco)
+    except (OSError, LoadError) as e:
+        print(f"Error: {e}")
+        sys.exit(1)
+
+    tempo = time.perf_counter() - inicio
+    print(f"Scored {quantidade} assignments in {tempo:.2f} s "
+          f"({quantidade / tempo if tempo > 0 else 0.0:.1f} assignments/s)")
+    print(f"Results written to {args['--saida']}")
+
+###############################################################################
+
+if __name__ == "__main__":
+    main()
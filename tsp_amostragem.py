@@ -0,0 +1,161 @@
+###############################################################################
+# tsp_amostragem.py: multi-fidelity evaluation, decoding the chromosomes on a
+# stratified sample of the clients that grows along the evolution.
+#
+# This code is released under LICENSE.md.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+###############################################################################
+
+import copy
+
+from brkga_mp_ipr.types import BaseChromosome
+import numpy as np
+
+from tsp_decoder import TSPDecoder, CODIFICACAO_CHAVES
+from tsp_paralelo import DecoderParalelo
+
+#a cada aumento, a fração amostrada é multiplicada por este fator (até a base inteira)
+FATOR_CRESCIMENTO = 2
+
+class DecoderAmostral():
+    """
+    Decoder de múltipla fidelidade: avalia os cromossomos completos lendo só
+    os genes de uma amostra das linhas da instância, estratificada por Taxa e
+    Flag_Efet. Cada estrato é amostrado na mesma fração e cada linha sorteada
+    pesa (linhas do estrato / linhas sorteadas), então as contagens, as taxas
+    e as penalidades estimam as da base inteira e o custo do decode cai na
+    proporção da amostra. Sobre um DecoderParalelo, a amostra é publicada
+    para os mesmos processos (ver DecoderParalelo.publicar()).
+
+    As amostras são encaixadas: cada estrato é embaralhado uma vez e a
+    amostra de uma fração é o começo dessa ordem, então aumentar a fração só
+    acrescenta linhas. Com fração 1, as chamadas vão direto para o decoder
+    da base inteira, com o resultado exato.
+
+    Os fitness de frações diferentes não são comparáveis: depois de
+    definir_fracao(), reavalie as populações e esvazie o cache de fitness.
+    A codificação por chaves já tem custo proporcional às chaves, e não aos
+    clientes, e não é aceita.
+    """
+
+    def __init__(self, decoder, fracao: float, semente: int):
+        """
+        decoder é o decoder da base inteira: um TSPDecoder ou um
+        DecoderParalelo sobre ele, usado com fração 1 e para reescrever().
+        """
+        self.decoder = decoder
+        self.base = decoder if isinstance(decoder, TSPDecoder) else decoder.decoder
+        #quem avalia a amostra: ela mesma ou a sua publicação nos processos do DecoderParalelo
+        self.avaliador = None
+        if self.base.codificacao == CODIFICACAO_CHAVES:
+            raise ValueError("A amostragem não se aplica à codificação por chaves")
+        self.tamanho_cromossomo = self.base.tamanho_cromossomo
+
+        #linhas de cada estrato (taxa x efetivado), já na ordem em que entram na amostra
+        rng = np.random.default_rng(semente)
+        estrato = self.base.codigo_taxa*2 + (self.base.flag_efet > 0)
+        ordem = np.argsort(estrato, kind='stable')
+        inicios = np.flatnonzero(np.diff(estrato[ordem], prepend=-1))
+        self.estratos = [rng.permutation(linhas) for linhas in np.split(ordem, inicios[1:])]
+
+        self.definir_fracao(fracao)
+
+    @property
+    def completa(self) -> bool:
+        return self.fracao >= 1
+
+    def definir_fracao(self, fracao: float) -> None:
+        """
+        Passa a avaliar com a fração `fracao` das linhas de cada estrato (no
+        mínimo uma), ou com a base inteira se `fracao` >= 1.
+        """
+        self.fracao = min(1.0, fracao)
+        self.fechar()
+        self.amostra = None
+        if self.completa:
+            self.qtd_linhas = self.base.qtd_clientes
+            return
+
+        linhas = []
+        fatores = []
+        for estrato in self.estratos:
+            qtd = max(1, int(round(self.fracao*len(estrato))))
+            linhas.append(estrato[:qtd])
+            fatores.append(np.full(qtd, len(estrato)/qtd))
+        linhas = np.concatenate(linhas)
+        fatores = np.concatenate(fatores)
+        ordem = np.argsort(linhas)
+        linhas = linhas[ordem]
+        fatores = fatores[ordem]
+        self.qtd_linhas = len(linhas)
+
+        #a amostra é uma instância comprimida com os pesos (fracionários) multiplicados pelos fatores
+        base = self.base
+        instancia = copy.copy(base.instance)
+        df = base.instance.df.iloc[linhas].reset_index(drop=True)
+        df['Clientes'] = base.peso_cliente[linhas]*fatores
+        df['Efetivados'] = base.flag_efet[linhas]*fatores
+        instancia.df = df
+        instancia.comprimida = True
+
+        amostra = TSPDecoder(instancia, base.qtd_grupos, base.qtd_variaveis,
+                             base.elementos_por_bloco, base.codificacao)
+        #a tabela rotula as taxas na ordem em que aparecem na base inteira, não na amostra
+        amostra.valores_taxa = base.valores_taxa
+        amostra.perfil = base.perfil
+        self.amostra = amostra
+        self.avaliador = self.decoder.publicar(amostra) if isinstance(self.decoder, DecoderParalelo) else amostra
+
+        #genes lidos pela amostra: os das variáveis e os das linhas sorteadas
+        genes_por_cliente = base.genes_por_cliente
+        genes_linhas = base.qtd_variaveis + linhas[:, None]*genes_por_cliente + np.arange(genes_por_cliente)
+        self.genes = np.concatenate([np.arange(base.qtd_variaveis), genes_linhas.ravel()])
+
+    def crescer(self) -> None:
+        self.definir_fracao(self.fracao*FATOR_CRESCIMENTO)
+
+    def fechar(self):
+        #remove a memória compartilhada da amostra publicada, se houver
+        if self.avaliador is not None and self.avaliador is not self.amostra:
+            self.avaliador.fechar()
+        self.avaliador = None
+
+    ###########################################################################
+
+    def amostrar(self, cromossomos) -> np.ndarray:
+        return np.asarray(cromossomos)[:, self.genes]
+
+    def decode(self, chromosome: BaseChromosome, rewrite: bool) -> float:
+        return float(self.decode_lote([chromosome], rewrite)[0])
+
+    def decode_lote(self, cromossomos, rewrite: bool = False) -> np.ndarray:
+        if self.completa:
+            return self.decoder.decode_lote(cromossomos, rewrite)
+        if rewrite:
+            #o reparo olha todos os clientes, para que os genes fora da amostra também fiquem viáveis
+            cromossomos = self.reescrever(cromossomos)
+        return self.avaliador.decode_lote(self.amostrar(cromossomos))
+
+    def discretizar(self, cromossomos) -> np.ndarray:
+        if self.completa:
+            return self.decoder.discretizar(cromossomos)
+        return self.amostra.discretizar(self.amostrar(cromossomos))
+
+    def avaliar_discretos(self, discretos: np.ndarray) -> np.ndarray:
+        if self.completa:
+            return self.decoder.avaliar_discretos(discretos)
+        return self.avaliador.avaliar_discretos(discretos)
+
+    def reescrever(self, cromossomos) -> np.ndarray:
+        return self.decoder.reescrever(cromossomos)
@@ -0,0 +1,470 @@
+###############################################################################
+# tsp_brkga.py: BRKGA-MP-IPR that decodes each population in a single batch.
+#
+# This code is released under LICENSE.md.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+###############################################################################
+
+import math
+import time
+
+import numpy as np
+
+from brkga_mp_ipr.enums import Sense
+from brkga_mp_ipr.types import Population
+from brkga_mp_ipr.algorithm import BrkgaMpIpr
+
+from tsp_decoder import TIPOS_GENE, desquantizar, quantizar
+
+#genes (indivíduos x colunas) convertidos por vez para chaves ao medir a diversidade, para não
+#copiar a população inteira
+GENES_POR_BLOCO = 2**16
+
+class BrkgaMpIprLote(BrkgaMpIpr):
+    """
+    BrkgaMpIpr que, em vez de chamar decode() para cada cromossomo, entrega a
+    população inteira para decoder.decode_lote().
+
+    A sequência de números aleatórios é a mesma do BrkgaMpIpr, mas a elite é
+    copiada como no BRKGA em C++ (as linhas que o fitness aponta, e não as
+    primeiras), então o melhor fitness é sempre o de um cromossomo guardado;
+    a trajetória difere da do BrkgaMpIpr em Python a partir da segunda
+    geração.
+
+    Com reescrever=True, os cromossomos são reparados pelo decoder antes de
+    avaliados (decode_lote com rewrite), como o rewrite=True que o
+    BrkgaMpIpr passa para decode().
+
+    Cada população é uma matriz (indivíduos x genes) do tipo `armazenamento`
+    (um dos tsp_decoder.TIPOS_GENE), e population.chromosomes são as linhas
+    dela. O decoder recebe a matriz, sem conversão: em float32 ou em códigos
+    uint16/uint8 a população ocupa de 1/2 a 1/8 da memória do float64, com os
+    mesmos sorteios; só muda a precisão guardada das chaves.
+
+    Com um decoder `incremental` (um TSPDecoder na codificação por grupos),
+    cada filho do cruzamento é avaliado por decode_incremental() a partir do
+    pai que lhe deu mais genes, atualizando as tabelas do pai só nos genes
+    que mudaram; os mutantes seguem para decode_lote(). O reparo muda os
+    filhos depois do cruzamento e não pode ser usado junto.
+    """
+
+    def __init__(self, *args, reescrever: bool = False, armazenamento: str = "float64",
+                 incremental=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        if armazenamento not in TIPOS_GENE:
+            raise ValueError(f"Unknown population storage: {armazenamento} "
+                             f"(use {', '.join(TIPOS_GENE)})")
+        if incremental is not None and reescrever:
+            raise ValueError("The incremental evaluation cannot be used with the repair")
+        self.reescrever = reescrever
+        self.incremental = incremental
+        self.armazenamento = armazenamento
+        self.tipo_gene = np.dtype(TIPOS_GENE[armazenamento])
+        #cromossomos entregues ao decoder, para medir a vazão
+        self.decodificacoes = 0
+
+    def nova_populacao(self, matriz: np.ndarray = None) -> Population:
+        #population.chromosomes são vistas das linhas da matriz, que é o que o decoder recebe
+        population = Population()
+        if matriz is None:
+            matriz = np.empty((self.params.population_size, self.chromosome_size), dtype=self.tipo_gene)
+        population.matriz = matriz
+        population.chromosomes = list(matriz)
+        return population
+
+    def copiar_populacoes(self) -> list:
+        #no lugar de copy.deepcopy, que copiaria cada linha separada da matriz
+        copias = []
+        for population in self._current_populations:
+            copia = self.nova_populacao(population.matriz.copy())
+            copia.fitness = list(population.fitness)
+            copias.append(copia)
+        return copias
+
+    def fill_chromosome(self, chromosome) -> None:
+        #os mesmos sorteios do BrkgaMpIpr, guardados no tipo da população
+        chromosome[:] = quantizar([self._rng.random() for _ in range(len(chromosome))], self.tipo_gene)
+
+    def get_best_chromosome(self) -> list:
+        """
+        Devolve as chaves do melhor indivíduo, em [0, 1), qualquer que seja o
+        armazenamento.
+        """
+        return desquantizar(super().get_best_chromosome()).tolist()
+
+    def avaliar(self, cromossomos) -> list:
+        self.decodificacoes += len(cromossomos)
+        return self._decoder.decode_lote(cromossomos, self.reescrever).tolist()
+
+    def avaliar_incremental(self, pais: np.ndarray, referencias: np.ndarray, filhos: np.ndarray) -> list:
+        #avalia cada filho a partir da linha referencias[i] de pais; cada pai vira referência uma vez
+        self.decodificacoes += len(filhos)
+        valores = [0.0]*len(filhos)
+        for linha in np.unique(referencias):
+            self.incremental.definir_referencia(pais[linha])
+            for i in np.flatnonzero(referencias == linha):
+                valores[i] = self.incremental.decode_incremental(filhos[i])
+        return valores
+
+    ###########################################################################
+
+    def initialize(self) -> None:
+        if self._initialized and not self._reset_phase:
+            raise RuntimeError("The algorithm is already initialized. "
+                               "Please call 'reset()' instead.")
+
+        if self._bias_function is None:
+            raise ValueError("The bias function is not defined. "
+                             "Call set_bias_custom_function() before call "
+                             "initialize().")
+
+        #as populações passam a ser matrizes; os sorteios seguem a ordem do BrkgaMpIpr
+        if not self._reset_phase:
+            # If we have warmstaters, they go first in the population 0.
+            iniciais = self._current_populations[0].chromosomes if self._current_populations else []
+            self._current_populations = [
+                self.nova_populacao()
+                for _ in range(self.params.num_independent_populations)
+            ]
+            for i, chromosome in enumerate(iniciais):
+                self._current_populations[0].matriz[i] = quantizar(chromosome, self.tipo_gene)
+            inicio = len(iniciais)
+        else:
+            inicio = 0
+
+        for population in self._current_populations:
+            for chromosome in population.chromosomes[inicio:]:
+                self.fill_chromosome(chromosome)
+            inicio = 0
+
+        #decodifica cada população de uma vez
+        for population in self._current_populations:
+            valores = self.avaliar(population.matriz)
+            population.fitness = [(valor, i) for i, valor in enumerate(valores)]
+            population.fitness.sort(reverse=(self.opt_sense == Sense.MAXIMIZE))
+
+        self._previous_populations = self.copiar_populacoes()
+        self._initialized = True
+        self._reset_phase = False
+
+    ###########################################################################
+
+    def evolve_population(self, population_index: int) -> None:
+        if not self._initialized:
+            raise RuntimeError("The algorithm hasn't been initialized. "
+                               "Call 'initialize()' before "
+                               "'evolve_population()'")
+
+        if population_index < 0 or \
+           population_index >= self.params.num_independent_populations:
+            raise ValueError(
+                f"Population must be in "
+                f"[0, {self.params.num_independent_populations - 1}]: "
+                f"{population_index}")
+
+        curr_pop = self._current_populations[population_index]
+        next_pop = self._previous_populations[population_index]
+
+        replace_idx = self.params.population_size - self.num_mutants
+
+        # First, we copy the elite chromosomes to the next generation.
+        #a elite são as linhas apontadas pelo fitness ordenado, que vão para as primeiras linhas da
+        #nova população com os índices ajustados, como no BRKGA em C++ (o BrkgaMpIpr em Python copia
+        #as primeiras linhas por posição e deixa o fitness apontando para linhas sobrescritas)
+        elite = [idx for _, idx in curr_pop.fitness[:self.elite_size]]
+        next_pop.matriz[:self.elite_size] = curr_pop.matriz[elite]
+        for i in range(self.elite_size):
+            next_pop.fitness[i] = (curr_pop.fitness[i][0], i)
+
+        #o pai de cada gene é o primeiro cuja probabilidade acumulada alcança o sorteio, como no
+        #laço do BrkgaMpIpr; as somas são feitas na mesma ordem, então a escolha é a mesma
+        acumulada = []
+        cumulative_probability = 0.0
+        for parent in range(1, self.params.total_parents + 1):
+            cumulative_probability += self._bias_function(parent) / self._total_bias_weight
+            acumulada.append(cumulative_probability)
+        genes = np.arange(self.chromosome_size)
+        #linha (em curr_pop) do pai que deu mais genes a cada filho, para a avaliação incremental
+        referencias = np.empty(replace_idx - self.elite_size, dtype=np.int64)
+
+        # Then, we mate/crossover 'pop_size - elite_size - num_mutants' pairs.
+        for chr_idx in range(self.elite_size, replace_idx):
+            elite_indices = list(range(self.elite_size))
+            self._rng.shuffle(elite_indices)
+            non_elite_indices = list(range(self.elite_size, replace_idx))
+            self._rng.shuffle(non_elite_indices)
+            shuffled_individuals = elite_indices + non_elite_indices
+
+            for i in range(self.params.num_elite_parents):
+                self._parents_ordered[i] = \
+                    curr_pop.fitness[shuffled_individuals[i]]
+
+            for i in range(self.params.total_parents -
+                           self.params.num_elite_parents):
+                self._parents_ordered[i + self.params.num_elite_parents] = \
+                    curr_pop.fitness[shuffled_individuals[i + self.elite_size]]
+
+            self._parents_ordered.sort(reverse=(self.opt_sense ==
+                                                Sense.MAXIMIZE))
+
+            #um sorteio por gene, na ordem dos genes; um sorteio 0.0 não entra no laço
+            #do BrkgaMpIpr e fica com o último pai
+            tosses = np.array([self._rng.random() for _ in range(self.chromosome_size)])
+            parent = np.minimum(np.searchsorted(acumulada, tosses), self.params.total_parents - 1)
+            parent[tosses == 0.0] = self.params.total_parents - 1
+            linhas = np.array([idx for _, idx in self._parents_ordered])
+            next_pop.matriz[chr_idx] = curr_pop.matriz[linhas[parent], genes]
+            if self.incremental is not None:
+                referencias[chr_idx - self.elite_size] = linhas[np.bincount(parent).argmax()]
+
+        # To finish, we fill up the remaining spots with mutants.
+        for chr_idx in range(replace_idx, self.params.population_size):
+            self.fill_chromosome(next_pop.chromosomes[chr_idx])
+
+        #decodifica os filhos e os mutantes de uma vez
+        if self.incremental is None:
+            valores = self.avaliar(next_pop.matriz[self.elite_size:])
+        else:
+            valores = self.avaliar_incremental(curr_pop.matriz, referencias,
+                                               next_pop.matriz[self.elite_size:replace_idx])
+            if replace_idx < self.params.population_size:
+                valores += self.avaliar(next_pop.matriz[replace_idx:])
+        for i, valor in enumerate(valores, start=self.elite_size):
+            next_pop.fitness[i] = (valor, i)
+
+        next_pop.fitness.sort(reverse=(self.opt_sense == Sense.MAXIMIZE))
+
+        # Swap populations.
+        self._previous_populations[population_index], \
+        self._current_populations[population_index] = \
+            self._current_populations[population_index], \
+            self._previous_populations[population_index]
+
+    ###########################################################################
+
+    def elite(self, population_index: int, quantidade: int) -> list:
+        """
+        Devolve cópias dos `quantidade` melhores indivíduos da população, como
+        pares (fitness, cromossomo), do melhor para o pior, com os genes no
+        tipo do armazenamento.
+        """
+        population = self._current_populations[population_index]
+        return [(valor, population.chromosomes[idx].copy())
+                for valor, idx in population.fitness[:quantidade]]
+
+    def inserir_imigrantes(self, population_index: int, imigrantes: list) -> None:
+        """
+        Troca os piores indivíduos da população pelos imigrantes, pares
+        (fitness, cromossomo) já avaliados, e reordena a população.
+
+        Raises:
+            ``ValueError``: Se os imigrantes não couberem fora da elite.
+        """
+        if len(imigrantes) > self.params.population_size - self.elite_size:
+            raise ValueError(f"Too many immigrants: {len(imigrantes)} "
+                             f"(at most {self.params.population_size - self.elite_size})")
+
+        population = self._current_populations[population_index]
+        for posicao, (valor, cromossomo) in enumerate(imigrantes):
+            posicao = self.params.population_size - 1 - posicao
+            idx = population.fitness[posicao][1]
+            population.chromosomes[idx][:] = cromossomo
+            population.fitness[posicao] = (valor, idx)
+        population.fitness.sort(reverse=(self.opt_sense == Sense.MAXIMIZE))
+
+    def exchange_elite(self, num_immigrants: int) -> None:
+        """
+        Cada população recebe os `num_immigrants` melhores indivíduos de cada
+        uma das outras, no lugar dos seus piores, como no BRKGA-MP-IPR em C++.
+        """
+        if not self._initialized:
+            raise RuntimeError("The algorithm hasn't been initialized. "
+                               "Call 'initialize()' before 'exchange_elite()'")
+
+        qtd_populacoes = self.params.num_independent_populations
+        elites = [self.elite(i, num_immigrants) for i in range(qtd_populacoes)]
+        for i in range(qtd_populacoes):
+            imigrantes = [individuo for j in range(qtd_populacoes) if j != i for individuo in elites[j]]
+            self.inserir_imigrantes(i, imigrantes)
+
+    def controlar(self, geracao: int, control_params, medir=None) -> None:
+        """
+        Aplica os eventos de ExternalControlParams ao fim da geração
+        `geracao`: a troca de elite a cada exchange_interval gerações (com
+        mais de uma população) e, depois dela, o reinício a cada
+        reset_interval gerações (0 desliga cada um). Se dado,
+        medir(nome, funcao, *args) executa e cronometra cada evento (ver
+        tsp_telemetria.Eventos.medir).
+        """
+        if medir is None:
+            medir = lambda nome, funcao, *args: funcao(*args)
+        if control_params.exchange_interval > 0 and geracao % control_params.exchange_interval == 0 \
+                and self.params.num_independent_populations > 1:
+            medir("troca", self.exchange_elite, control_params.num_exchange_indivuduals)
+        if control_params.reset_interval > 0 and geracao % control_params.reset_interval == 0:
+            medir("reinicio", self.reiniciar)
+
+    def reiniciar(self) -> None:
+        """
+        Como reset(), que troca todas as populações por chaves novas, mas
+        devolve o melhor indivíduo à população de onde veio, no lugar do
+        pior, para que o melhor fitness não se perca.
+        """
+        melhores = [self.elite(i, 1)[0] for i in range(self.params.num_independent_populations)]
+        origem = 0
+        for i, (valor, _) in enumerate(melhores):
+            if (valor < melhores[origem][0]) == (self.opt_sense == Sense.MINIMIZE):
+                origem = i
+        self.reset()
+        self.inserir_imigrantes(origem, [melhores[origem]])
+
+    def estatisticas(self) -> list:
+        """
+        Devolve, para cada população, um dicionário com o melhor e o médio
+        fitness e a diversidade: o desvio padrão das chaves de cada gene, na
+        média dos genes (0 com todos os indivíduos iguais, perto de 0.29 com
+        chaves uniformes).
+        """
+        estatisticas = []
+        for population in self._current_populations:
+            valores = np.array([valor for valor, _ in population.fitness])
+            desvios = 0.0
+            colunas = max(1, GENES_POR_BLOCO // len(population.matriz))
+            for inicio in range(0, self.chromosome_size, colunas):
+                chaves = desquantizar(population.matriz[:, inicio:inicio+colunas])
+                desvios += chaves.std(axis=0).sum()
+            estatisticas.append({
+                "melhor": float(population.fitness[0][0]),
+                "media": float(valores.mean()),
+                "diversidade": float(desvios / self.chromosome_size),
+            })
+        return estatisticas
+
+    def reavaliar(self) -> None:
+        """
+        Avalia de novo todas as populações e as reordena, para quando o
+        decoder passa a dar outro fitness aos mesmos cromossomos (por exemplo,
+        ao mudar a fração de tsp_amostragem.DecoderAmostral).
+        """
+        for population in self._current_populations:
+            valores = self.avaliar(population.matriz)
+            population.fitness = [(valor, i) for i, valor in enumerate(valores)]
+            population.fitness.sort(reverse=(self.opt_sense == Sense.MAXIMIZE))
+
+    ###########################################################################
+
+    def estado(self) -> tuple:
+        """
+        Devolve (arrays, escalares) com o necessário para continuar a evolução
+        exatamente do ponto atual: cromossomos e fitness ordenado de cada
+        população e o estado do gerador de números aleatórios. As populações
+        anteriores não entram, pois evolve_population() as sobrescreve.
+        """
+        arrays = {}
+        for i, population in enumerate(self._current_populations):
+            arrays[f"cromossomos_{i}"] = population.matriz
+            arrays[f"fitness_{i}"] = np.array([valor for valor, _ in population.fitness], dtype=np.float64)
+            arrays[f"indices_{i}"] = np.array([idx for _, idx in population.fitness], dtype=np.int64)
+
+        versao, interno, gauss = self._rng.getstate()
+        arrays["rng"] = np.array(interno, dtype=np.uint32)
+        escalares = {
+            "populacoes": len(self._current_populations),
+            "rng_versao": versao,
+            "rng_gauss": gauss,
+            "armazenamento": self.armazenamento,
+        }
+        return arrays, escalares
+
+    def restaurar(self, arrays: dict, escalares: dict) -> None:
+        """
+        Substitui as populações e o gerador de números aleatórios pelo estado
+        devolvido por estado(), no lugar de initialize().
+
+        Raises:
+            ``ValueError``: Se o estado for de outro armazenamento.
+        """
+        armazenamento = escalares.get("armazenamento", "float64")
+        if armazenamento != self.armazenamento:
+            raise ValueError(f"The state was saved with {armazenamento} storage, "
+                             f"not {self.armazenamento}")
+
+        self._current_populations = []
+        for i in range(escalares["populacoes"]):
+            population = self.nova_populacao(np.array(arrays[f"cromossomos_{i}"], dtype=self.tipo_gene))
+            population.fitness = list(zip(arrays[f"fitness_{i}"].tolist(), arrays[f"indices_{i}"].tolist()))
+            self._current_populations.append(population)
+
+        self._rng.setstate((escalares["rng_versao"], tuple(arrays["rng"].tolist()), escalares["rng_gauss"]))
+        self._previous_populations = self.copiar_populacoes()
+        self._initialized = True
+        self._reset_phase = False
+
+###############################################################################
+
+class CriterioParada():
+    """
+    Decide quando parar uma evolução de minimização, verificada a cada
+    geração: pelo total de gerações, pelo tempo de relógio, por gerações
+    seguidas sem melhora do melhor fitness ou ao atingir o fitness alvo.
+    Limites iguais a 0 (e o alvo -inf) ficam desligados.
+    """
+
+    def __init__(self, max_geracoes: int = 0, tempo_maximo: float = 0.0,
+                 geracoes_sem_melhora: int = 0, fitness_alvo: float = -math.inf):
+        self.max_geracoes = max_geracoes
+        self.tempo_maximo = tempo_maximo
+        self.geracoes_sem_melhora = geracoes_sem_melhora
+        self.fitness_alvo = fitness_alvo
+        self.limitado = max_geracoes > 0 or tempo_maximo > 0 or geracoes_sem_melhora > 0 \
+            or fitness_alvo > -math.inf
+
+    def iniciar(self, geracao: int, melhor: float, ultima_melhora: int = None):
+        self.inicio = time.perf_counter()
+        self.geracao = geracao
+        self.melhor = melhor
+        self.ultima_melhora = geracao if ultima_melhora is None else ultima_melhora
+
+    def atualizar(self, geracao: int, melhor: float):
+        self.geracao = geracao
+        if melhor < self.melhor:
+            self.melhor = melhor
+            self.ultima_melhora = geracao
+
+    def redefinir(self, geracao: int, melhor: float):
+        #o fitness mudou de escala (outro decoder): recomeça a contagem sem melhora
+        self.melhor = melhor
+        self.ultima_melhora = geracao
+
+    def esgotado(self) -> bool:
+        """
+        Diz se o orçamento de gerações ou de tempo acabou, independentemente
+        do fitness.
+        """
+        return (self.max_geracoes > 0 and self.geracao >= self.max_geracoes) or \
+            (self.tempo_maximo > 0 and time.perf_counter() - self.inicio >= self.tempo_maximo)
+
+    def motivo(self):
+        """
+        Devolve por que a evolução deve parar, ou None para continuar.
+        """
+        if self.melhor <= self.fitness_alvo:
+            return f"target fitness {self.fitness_alvo} reached"
+        if self.max_geracoes > 0 and self.geracao >= self.max_geracoes:
+            return f"{self.max_geracoes} generations"
+        if self.geracoes_sem_melhora > 0 and self.geracao - self.ultima_melhora >= self.geracoes_sem_melhora:
+            return f"{self.geracoes_sem_melhora} generations without improvement"
+        if self.tempo_maximo > 0 and time.perf_counter() - self.inicio >= self.tempo_maximo:
+            return f"time budget of {self.tempo_maximo} s"
+        return None
@@ -0,0 +1,121 @@
+###############################################################################
+# tsp_cache.py: fitness memoization keyed on the thresholded chromosome.
+#
+# This code is released under LICENSE.md.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+###############################################################################
+
+from collections import OrderedDict
+from brkga_mp_ipr.types import BaseChromosome
+import hashlib
+import numpy as np
+
+#custo aproximado de uma entrada: chave de 16 bytes, float e o nó do OrderedDict
+BYTES_POR_ENTRADA = 200
+
+#limita a quantidade de genes convertidos por discretizar() de uma vez
+BITS_POR_BLOCO = 2**26
+
+class CacheFitness():
+    """
+    Guarda o fitness de cada solução já decodificada.
+
+    O decode corta cada gene em 0.5 (ou em faixas, na codificação compacta),
+    então muitos cromossomos diferentes são a mesma solução. A chave do cache é
+    o hash da solução devolvida por discretizar(); as entradas menos usadas
+    recentemente são descartadas quando o limite de memória é atingido.
+    """
+
+    def __init__(self, decoder, limite_mb: int):
+        self.decoder = decoder
+        self.max_entradas = max(1, limite_mb * 2**20 // BYTES_POR_ENTRADA)
+        self.entradas = OrderedDict()
+        self.acertos = 0
+        self.falhas = 0
+        self.descartes = 0
+
+    ###########################################################################
+
+    def decode(self, chromosome: BaseChromosome, rewrite: bool) -> float:
+        return float(self.decode_lote([chromosome], rewrite)[0])
+
+    def decode_lote(self, cromossomos, rewrite: bool = False) -> np.ndarray:
+        if rewrite:
+            cromossomos = self.reescrever(cromossomos)
+        fitness = np.empty(len(cromossomos))
+        if len(cromossomos) == 0:
+            return fitness
+
+        tamanho = max(1, BITS_POR_BLOCO // len(cromossomos[0]))
+        for inicio in range(0, len(cromossomos), tamanho):
+            discretos = self.decoder.discretizar(cromossomos[inicio:inicio+tamanho])
+            fitness[inicio:inicio+len(discretos)] = self.avaliar_discretos(discretos)
+        return fitness
+
+    def discretizar(self, cromossomos) -> np.ndarray:
+        return self.decoder.discretizar(cromossomos)
+
+    def reescrever(self, cromossomos) -> np.ndarray:
+        return self.decoder.reescrever(cromossomos)
+
+    def avaliar_discretos(self, discretos: np.ndarray) -> np.ndarray:
+        fitness = np.empty(len(discretos))
+        if discretos.dtype == bool:
+            linhas = np.packbits(discretos, axis=1)
+        else:
+            linhas = discretos
+        chaves = [hashlib.blake2b(linha.tobytes(), digest_size=16).digest() for linha in linhas]
+
+        #soluções repetidas no mesmo lote são decodificadas uma única vez
+        pendentes = {}
+        for i, chave in enumerate(chaves):
+            valor = self.entradas.get(chave)
+            if valor is not None:
+                self.entradas.move_to_end(chave)
+                self.acertos += 1
+                fitness[i] = valor
+            elif chave in pendentes:
+                self.acertos += 1
+                pendentes[chave].append(i)
+            else:
+                self.falhas += 1
+                pendentes[chave] = [i]
+
+        if pendentes:
+            primeiros = [posicoes[0] for posicoes in pendentes.values()]
+            valores = self.decoder.avaliar_discretos(discretos[primeiros])
+            for (chave, posicoes), valor in zip(pendentes.items(), valores.tolist()):
+                fitness[posicoes] = valor
+                self.inserir(chave, valor)
+
+        return fitness
+
+    def inserir(self, chave: bytes, valor: float):
+        self.entradas[chave] = valor
+        if len(self.entradas) > self.max_entradas:
+            self.entradas.popitem(last=False)
+            self.descartes += 1
+
+    def limpar(self):
+        #para quando o decoder por baixo passa a dar outro fitness às mesmas soluções
+        self.entradas.clear()
+
+    ###########################################################################
+
+    def resumo(self) -> str:
+        total = self.acertos + self.falhas
+        taxa = 100 * self.acertos / total if total else 0.0
+        return (f"Fitness cache: {self.acertos} hits, {self.falhas} misses "
+                f"({taxa:.1f}% hit rate), {self.descartes} evictions, "
+                f"{len(self.entradas)} entries")
@@ -0,0 +1,88 @@
+###############################################################################
+# tsp_checkpoint.py: periodic snapshots of the evolution, to resume a killed
+# run on the same trajectory.
+#
+# This code is released under LICENSE.md.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+###############################################################################
+
+import json
+import os
+
+import numpy as np
+
+from tsp_brkga import BrkgaMpIprLote
+
+#o checkpoint é um .npz sem compressão: um cabeçalho JSON e os arrays de BrkgaMpIprLote.estado()
+VERSAO_CHECKPOINT = 1
+
+#campos do cabeçalho que precisam coincidir para continuar a mesma execução
+CAMPOS_VERIFICADOS = ['seed', 'tamanho_cromossomo', 'population_size', 'populacoes']
+
+def gravar_checkpoint(filename: str, brkga: BrkgaMpIprLote, seed: int, geracao: int, **extras):
+    """
+    Grava o estado do BRKGA após `geracao` gerações, com os valores de
+    `extras` no cabeçalho. O arquivo é escrito ao lado e renomeado no fim,
+    então um processo morto no meio da gravação deixa o checkpoint anterior
+    intacto.
+    """
+    arrays, escalares = brkga.estado()
+    arrays["melhor_cromossomo"] = np.array(brkga.get_best_chromosome(), dtype=np.float64)
+    cabecalho = {
+        "versao": VERSAO_CHECKPOINT,
+        "geracao": geracao,
+        "seed": seed,
+        "tamanho_cromossomo": brkga.chromosome_size,
+        "population_size": brkga.params.population_size,
+        "melhor_fitness": brkga.get_best_fitness(),
+        **escalares,
+        **extras,
+    }
+
+    temporario = f"{filename}.tmp"
+    with open(temporario, "wb") as hd:
+        np.savez(hd, cabecalho=np.array(json.dumps(cabecalho)), **arrays)
+        hd.flush()
+        os.fsync(hd.fileno())
+    os.replace(temporario, filename)
+
+def ler_checkpoint(filename: str, brkga: BrkgaMpIprLote, seed: int) -> dict:
+    """
+    Restaura no BRKGA (no lugar de initialize()) o estado gravado e devolve o
+    cabeçalho, com a quantidade de gerações já evoluídas em "geracao".
+
+    Raises:
+        ValueError: Se o checkpoint for de outra versão ou de outra execução
+            (semente, tamanho do cromossomo ou das populações diferentes).
+    """
+    with np.load(filename, allow_pickle=False) as dados:
+        cabecalho = json.loads(str(dados["cabecalho"]))
+        if cabecalho.get("versao") != VERSAO_CHECKPOINT:
+            raise ValueError(f"Unsupported checkpoint version: {cabecalho.get('versao')}")
+
+        atual = {
+            "seed": seed,
+            "tamanho_cromossomo": brkga.chromosome_size,
+            "population_size": brkga.params.population_size,
+            "populacoes": brkga.params.num_independent_populations,
+        }
+        for campo in CAMPOS_VERIFICADOS:
+            if cabecalho[campo] != atual[campo]:
+                raise ValueError(f"Checkpoint {filename} is from another run: "
+                                 f"{campo} is {cabecalho[campo]}, expected {atual[campo]}")
+
+        arrays = {nome: dados[nome] for nome in dados.files if nome != "cabecalho"}
+
+    brkga.restaurar(arrays, cabecalho)
+    return cabecalho
@@ -0,0 +1,206 @@
+###############################################################################
+# tsp_config.py: reads the configuration file, accepting the parameters of
+# this application besides the BRKGA-MP-IPR ones.
+#
+# This code is released under LICENSE.md.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+###############################################################################
+
+import math
+import os
+import tempfile
+
+from brkga_mp_ipr.exceptions import LoadError
+from brkga_mp_ipr.types_io import load_configuration
+
+class ParametrosExecucao():
+    """
+    Parâmetros da aplicação que podem aparecer no arquivo de configuração junto
+    com os do BRKGA. Todos são opcionais e, se ausentes, ficam com o valor padrão.
+
+    Atributos:
+        qtd_grupos (int): Quantidade de grupos em que os clientes são divididos.
+
+        num_processos (int): Processos usados para decodificar as populações
+            (1 decodifica no próprio processo).
+
+        cache_instancia (bool): Lê a instância tratada do cache binário ao lado
+            do CSV, gerando-o na primeira leitura ou quando o CSV mudar.
+
+        tamanho_bloco_csv (int): Linhas lidas por vez do CSV; as categorias
+            são convertidas bloco a bloco e as linhas inválidas, rejeitadas
+            (0 lê o arquivo inteiro de uma vez).
+
+        codificacao (str): Codificação dos genes de grupo: "grupos",
+            "compacta" ou "chaves" (ver tsp_decoder.CODIFICACOES).
+
+        cache_fitness_mb (int): Limite de memória, em MB, do cache de fitness
+            das soluções já decodificadas (0 desliga o cache).
+
+        comprimir_clientes (bool): Junta os clientes idênticos em uma linha
+            com pesos (ver TSPInstance.comprimir()); os genes de grupo passam
+            a ser por linha distinta em vez de por cliente.
+
+        ilhas (bool): Evolui cada população independente em um processo,
+            trocando a elite a cada exchange_interval gerações (ver
+            tsp_ilhas.ExecucaoIlhas).
+
+        intervalo_checkpoint (int): A cada quantas gerações o estado da
+            evolução é gravado em arquivo_checkpoint (0 não grava).
+
+        arquivo_checkpoint (str): Arquivo do checkpoint, lido por --resume
+            (ver tsp_checkpoint).
+
+        tempo_maximo (float): Tempo de relógio, em segundos, após o qual a
+            evolução para (0 não limita).
+
+        geracoes_sem_melhora (int): Gerações seguidas sem melhorar a melhor
+            solução após as quais a evolução para (0 não limita).
+
+        fitness_alvo (float): A evolução para quando o melhor fitness chega
+            a este valor (-inf não limita).
+
+        fracao_heuristica (float): Fração da população inicial gerada pela
+            heurística gulosa de tsp_heuristica em vez de chaves aleatórias
+            (0 não usa a heurística).
+
+        reparar (bool): Repara e canoniza cada cromossomo avaliado (ver
+            TSPDecoder.reescrever()).
+
+        amostra_inicial (float): Fração das linhas da instância, amostradas
+            por Taxa e Flag_Efet, em que os cromossomos são avaliados no
+            início da evolução (1 avalia sempre na base inteira; ver
+            tsp_amostragem.DecoderAmostral).
+
+        geracoes_por_amostra (int): A cada quantas gerações a fração
+            amostrada dobra, até a base inteira (0 não aumenta por gerações).
+
+        amostra_sem_melhora (int): Gerações seguidas sem melhora após as quais
+            a fração amostrada dobra (0 não aumenta por estagnação).
+
+        intervalo_telemetria (int): A cada quantas gerações uma linha JSON
+            com a convergência é acrescentada a arquivo_telemetria (0 não
+            grava; ver tsp_telemetria).
+
+        arquivo_telemetria (str): Arquivo da telemetria.
+
+        armazenamento_populacao (str): Tipo em que os genes das populações
+            são guardados: "float64", "float32", "uint16" ou "uint8" (ver
+            tsp_decoder.TIPOS_GENE e tsp_brkga.BrkgaMpIprLote).
+
+        controle_populacoes (bool): Aplica exchange_interval e
+            reset_interval dos parâmetros de controle: troca a elite entre as
+            populações e as reinicia, mantendo o melhor indivíduo. Nas ilhas,
+            a migração acontece sempre e só o reinício depende deste valor.
+
+        avaliacao_incremental (bool): Avalia os filhos do cruzamento a partir
+            do pai que lhes deu mais genes (ver TSPDecoder.decode_incremental
+            e tsp_brkga.BrkgaMpIprLote). Só na codificação por grupos, sem
+            reparo nem amostragem.
+    """
+
+    def __init__(self):
+        self.qtd_grupos = 4
+        self.num_processos = 1
+        self.cache_instancia = True
+        self.tamanho_bloco_csv = 200000
+        self.codificacao = "grupos"
+        self.cache_fitness_mb = 256
+        self.comprimir_clientes = False
+        self.ilhas = False
+        self.intervalo_checkpoint = 0
+        self.arquivo_checkpoint = "tsp.checkpoint"
+        self.tempo_maximo = 0.0
+        self.geracoes_sem_melhora = 0
+        self.fitness_alvo = -math.inf
+        self.fracao_heuristica = 0.0
+        self.reparar = False
+        self.amostra_inicial = 1.0
+        self.geracoes_por_amostra = 0
+        self.amostra_sem_melhora = 0
+        self.intervalo_telemetria = 0
+        self.arquivo_telemetria = "telemetria.jsonl"
+        self.armazenamento_populacao = "float64"
+        self.controle_populacoes = False
+        self.avaliacao_incremental = False
+
+def converter_valor(tipo: type, valor: str):
+    if tipo is bool:
+        if valor.lower() in ("1", "true", "sim"):
+            return True
+        if valor.lower() in ("0", "false", "nao", "não"):
+            return False
+        raise ValueError(valor)
+    return tipo(valor)
+
+def carregar_configuracao(configuration_file: str) -> tuple:
+    """
+    Lê o arquivo de configuração e devolve (BrkgaParams, ExternalControlParams,
+    ParametrosExecucao). As linhas dos parâmetros da aplicação são separadas e
+    o restante é validado por load_configuration(), como antes.
+
+    Raises:
+        LoadError: Em caso de parâmetros faltando ou mal formatados.
+    """
+    parametros = ParametrosExecucao()
+
+    with open(configuration_file) as hd:
+        lines = hd.readlines()
+
+    restantes = []
+    for (line_number, line) in enumerate(lines):
+        campos = line.split()
+        if not campos or campos[0].lower() not in vars(parametros):
+            restantes.append(line)
+            continue
+
+        #mantém a numeração das linhas nas mensagens de erro do load_configuration()
+        restantes.append("\n")
+        if len(campos) != 2:
+            raise LoadError(f"Line {line_number}: "
+                            f"missing parameter or value")
+        nome, valor = campos[0].lower(), campos[1]
+        try:
+            setattr(parametros, nome, converter_valor(type(getattr(parametros, nome)), valor))
+        except ValueError:
+            raise LoadError(f"Line {line_number}: "
+                            f"invalid value for '{nome}': {valor}")
+
+    with tempfile.NamedTemporaryFile("w", suffix=".conf", delete=False) as hd:
+        hd.writelines(restantes)
+    try:
+        brkga_params, control_params = load_configuration(hd.name)
+    finally:
+        os.remove(hd.name)
+
+    return (brkga_params, control_params, parametros)
+
+def aplicar_parametro(configuracao: tuple, nome: str, valor: str) -> None:
+    """
+    Troca um parâmetro de uma configuração (BrkgaParams, ExternalControlParams,
+    ParametrosExecucao) já carregada, convertendo o valor como na leitura do
+    arquivo.
+
+    Raises:
+        LoadError: Se o parâmetro não existir ou o valor for inválido.
+    """
+    nome = nome.lower()
+    for dados in configuracao:
+        if nome in vars(dados):
+            try:
+                setattr(dados, nome, converter_valor(type(getattr(dados, nome)), valor))
+            except ValueError:
+                raise LoadError(f"invalid value for '{nome}': {valor}")
+            return
+    raise LoadError(f"parameter '{nome}' unknown")
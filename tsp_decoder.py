@@ -23,131 +23,600 @@
 
 from brkga_mp_ipr.types import BaseChromosome
 from tsp_instance import TSPInstance
+from tsp_perfil import PERFIL_DESLIGADO
 import numpy as np
 import pandas as pd
 
+#variáveis que formam a chave, na ordem em que são multiplicadas pelos cromossomos
+COLUNAS_VARIAVEIS = ['Compr_Renda', 'Nivel_Escolaridade', 'Estado_Civil', 'Regiao', 'Nivel_Risco_Novo']
+
+#codificações dos genes de grupo:
+#  grupos: qtd_grupos genes por cliente, cada um cortado em 0.5 (o cliente pode ficar em vários grupos)
+#  compacta: um gene por cliente, dividido em qtd_grupos+1 faixas; a primeira é "sem grupo"
+#  chaves: um gene, com as mesmas faixas, por chave da máscara escolhida; clientes com a mesma
+#          chave ficam sempre juntos, então não há penalidade de chave
+CODIFICACAO_GRUPOS = "grupos"
+CODIFICACAO_COMPACTA = "compacta"
+CODIFICACAO_CHAVES = "chaves"
+CODIFICACOES = [CODIFICACAO_GRUPOS, CODIFICACAO_COMPACTA, CODIFICACAO_CHAVES]
+
+#tipos em que os genes da população podem ser guardados (ver tsp_brkga.BrkgaMpIprLote); nos inteiros
+#sem sinal de b bits, o código q representa a chave (q + 0.5) / 2**b, e o decode lê os códigos direto
+TIPOS_GENE = {"float64": np.float64, "float32": np.float32, "uint16": np.uint16, "uint8": np.uint8}
+
+def desquantizar(cromossomos) -> np.ndarray:
+    """
+    Devolve, em float64, as chaves representadas pelos genes, guardados em
+    qualquer dos TIPOS_GENE.
+    """
+    cromossomos = np.asarray(cromossomos)
+    if cromossomos.dtype.kind != 'u':
+        return cromossomos.astype(np.float64)
+    return (cromossomos.astype(np.float64) + 0.5) / 2.0**(8*cromossomos.dtype.itemsize)
+
+def quantizar(chaves, tipo) -> np.ndarray:
+    """
+    Converte chaves em [0, 1) para genes do tipo `tipo`; nos inteiros, cada
+    chave vai para o código do intervalo que a contém.
+    """
+    chaves = np.asarray(chaves, dtype=np.float64)
+    tipo = np.dtype(tipo)
+    if tipo.kind != 'u':
+        return chaves.astype(tipo, copy=False)
+    niveis = 2**(8*tipo.itemsize)
+    return np.minimum(chaves*niveis, niveis - 1).astype(tipo)
+
 class TSPDecoder():
-    
-    def calcular_alfa(self, row, columns):
-        soma_linha = sum([row[i]*i for i in columns])
-        taxas_2 = [i*i for i in columns]
-        linhas_sem_taxas = sum(row[i] for i in columns)
 
-        n = 5*soma_linha-sum(columns) * linhas_sem_taxas
-        d = 5*sum(taxas_2) - sum(columns)**2
+    #estado pré-calculado que descreve a instância; é o que os processos de decodificação precisam
+    ARRAYS = ['chaves_por_mascara', 'clientes_por_chave', 'pesos_mascara', 'valores_taxa',
+              'indicadora_taxa', 'deslocamento_grupo', 'codigo_taxa', 'flag_efet', 'taxas_por_chave',
+              'peso_cliente']
+    ESCALARES = ['qtd_grupos', 'qtd_variaveis', 'qtd_clientes', 'elementos_por_bloco',
+                 'qtd_chaves', 'qtd_taxas', 'tipo_contagem', 'codificacao',
+                 'genes_por_cliente', 'tamanho_cromossomo']
+
+    def calcular_alfa(self, taxas):
+        #taxas: matriz (cromossomos x) grupos x taxas com o percentual de efetivados de cada grupo
+        colunas = self.valores_taxa
+        soma_linha = taxas @ colunas
+        taxas_2 = colunas * colunas
+        linhas_sem_taxas = taxas.sum(axis=-1)
+
+        n = 5*soma_linha - colunas.sum() * linhas_sem_taxas
+        d = 5*taxas_2.sum() - colunas.sum()**2
 
         return (n / d)*100
-    
-    def calcular_chave(self, row):
-        chave = 0
-        for i, valor in enumerate(row):
-            chave += valor * (10 ** i)
-        return chave
-
-    def calcular_penalizacao(self, row):
-        soma = 0
-        soma += sum(row)
-        if soma:
-            return (sum(row)-1)*100
-        return soma + 100
-
-    def __init__(self, instance: TSPInstance, qtd_grupos: int, qtd_variaveis: int):
+
+    def calcular_chave(self, mascaras):
+        #clientes com as mesmas variáveis selecionadas recebem a mesma chave (cromossomos x clientes)
+        return self.chaves_por_mascara[mascaras @ self.pesos_mascara]
+
+    def calcular_penalizacao(self, soma):
+        #soma: quantidade de grupos de cada cliente
+        return np.where(soma > 0, (soma - 1)*100, 100)
+
+    def __init__(self, instance: TSPInstance, qtd_grupos: int, qtd_variaveis: int,
+                 elementos_por_bloco: int = 2**22, codificacao: str = CODIFICACAO_GRUPOS):
+        if codificacao not in CODIFICACOES:
+            raise ValueError(f"Codificação desconhecida: {codificacao} (use {', '.join(CODIFICACOES)})")
+
         self.instance = instance
-        self.df_original = self.instance.df.copy()
         self.qtd_grupos = qtd_grupos
         self.qtd_variaveis = qtd_variaveis
+        self.codificacao = codificacao
+
+        df = self.instance.df
+        self.qtd_clientes = len(df.index)
+
+        #numa instância comprimida cada linha representa Clientes clientes idênticos, dos quais
+        #Efetivados têm Flag_Efet = 1; as contagens e penalidades são pesadas por esses valores,
+        #que podem ser fracionários numa amostra (ver tsp_amostragem)
+        if getattr(self.instance, 'comprimida', False):
+            tipo_peso = np.float64 if df['Clientes'].dtype.kind == 'f' else np.int64
+            self.peso_cliente = df['Clientes'].to_numpy(dtype=tipo_peso)
+            self.flag_efet = df['Efetivados'].to_numpy(dtype=tipo_peso)
+        else:
+            self.peso_cliente = np.ones(self.qtd_clientes, dtype=np.int64)
+            self.flag_efet = df['Flag_Efet'].to_numpy(dtype=np.int64)
+        self.genes_por_cliente = {CODIFICACAO_GRUPOS: qtd_grupos, CODIFICACAO_COMPACTA: 1, CODIFICACAO_CHAVES: 0}[codificacao]
+
+        #limita a quantidade de elementos (genes de grupo e tabelas por chave) avaliados juntos em decode_lote
+        self.elementos_por_bloco = elementos_por_bloco
+
+        #cada variável vira um código denso; a chave é a combinação desses códigos em base mista,
+        #o que separa os clientes exatamente como a chave em potências de 10
+        codigos = []
+        tamanhos = []
+        for coluna in COLUNAS_VARIAVEIS:
+            valores, codigo = np.unique(df[coluna].to_numpy(), return_inverse=True)
+            codigos.append(codigo)
+            tamanhos.append(len(valores))
+        codigos_variaveis = np.column_stack(codigos).astype(np.int64)
+        passos_chave = np.cumprod([1] + tamanhos[:-1]).astype(np.int64)
+
+        #as 2**qtd_variaveis máscaras possíveis são fixas: para cada uma, guarda a chave densa
+        #(0..chaves da máscara-1) de cada cliente e quantos clientes cada chave tem
+        qtd_mascaras = 2**len(COLUNAS_VARIAVEIS)
+        self.pesos_mascara = 2**np.arange(len(COLUNAS_VARIAVEIS))
+        chaves = []
+        contagens = []
+        for mascara in range(qtd_mascaras):
+            selecionadas = (mascara & self.pesos_mascara) > 0
+            chave = codigos_variaveis @ (passos_chave * selecionadas)
+            presentes = np.bincount(chave, minlength=int(np.prod(tamanhos)))
+            densa = np.cumsum(presentes > 0) - 1
+            chaves.append(densa[chave])
+            contagens.append(np.bincount(densa[chave], weights=self.peso_cliente).astype(self.peso_cliente.dtype))
+        self.qtd_chaves = max(len(contagem) for contagem in contagens)
+        tipo_chave = np.int16 if self.qtd_chaves <= np.iinfo(np.int16).max else np.int32
+        self.chaves_por_mascara = np.array(chaves, dtype=tipo_chave)
+        self.clientes_por_chave = np.zeros((qtd_mascaras, self.qtd_chaves), dtype=self.peso_cliente.dtype)
+        for mascara, contagem in enumerate(contagens):
+            self.clientes_por_chave[mascara, :len(contagem)] = contagem
+
+        #na codificação por chaves há um gene para cada chave da máscara com mais chaves; nas máscaras
+        #com menos chaves, os genes que sobram não são lidos
+        if codificacao == CODIFICACAO_CHAVES:
+            self.tamanho_cromossomo = self.qtd_chaves + qtd_variaveis
+        else:
+            self.tamanho_cromossomo = self.genes_por_cliente*self.qtd_clientes + qtd_variaveis
+
+        #o groupby conta as taxas em ordem crescente, mas a tabela rotula as colunas na ordem de unique()
+        taxas, codigo_taxa = np.unique(df['Taxa'].to_numpy(), return_inverse=True)
+        self.qtd_taxas = len(taxas)
+        self.valores_taxa = pd.unique(df['Taxa']).astype(np.float64)
+
+        #matriz clientes x (taxas, taxas dos efetivados): o produto com os grupos gera as duas contagens
+        #float32 conta sem erro até 2**24 clientes (com pesos inteiros)
+        exata = self.peso_cliente.dtype.kind == 'i' and self.peso_cliente.sum() < 2**24
+        self.tipo_contagem = np.float32 if exata else np.float64
+        linhas = np.arange(self.qtd_clientes)
+        self.indicadora_taxa = np.zeros((self.qtd_clientes, 2*self.qtd_taxas), dtype=self.tipo_contagem)
+        self.indicadora_taxa[linhas, codigo_taxa] = self.peso_cliente
+        self.indicadora_taxa[linhas, self.qtd_taxas + codigo_taxa] = self.flag_efet
+        self.deslocamento_grupo = np.arange(self.qtd_grupos)
+
+        #usados na avaliação incremental, que atualiza as tabelas cliente a cliente
+        self.codigo_taxa = codigo_taxa
+        self.referencia = None
+
+        #linhas da indicadora somadas por chave (máscaras x chaves x 2*taxas): na codificação por chaves,
+        #a contagem de um grupo é a soma das chaves que ele recebeu, sem passar pelos clientes
+        self.taxas_por_chave = np.zeros((qtd_mascaras, self.qtd_chaves, 2*self.qtd_taxas))
+        if codificacao == CODIFICACAO_CHAVES:
+            for mascara in range(qtd_mascaras):
+                indice_taxa = self.chaves_por_mascara[mascara].astype(np.int64)*self.qtd_taxas + codigo_taxa
+                tamanho = self.qtd_chaves*self.qtd_taxas
+                self.taxas_por_chave[mascara, :, :self.qtd_taxas] = \
+                    np.bincount(indice_taxa, weights=self.peso_cliente, minlength=tamanho).reshape(self.qtd_chaves, self.qtd_taxas)
+                self.taxas_por_chave[mascara, :, self.qtd_taxas:] = \
+                    np.bincount(indice_taxa, weights=self.flag_efet, minlength=tamanho).reshape(self.qtd_chaves, self.qtd_taxas)
+
+        #troque por um tsp_perfil.Perfil para medir cada etapa do decode
+        self.perfil = PERFIL_DESLIGADO
+
+    @classmethod
+    def de_estado(cls, arrays: dict, escalares: dict) -> 'TSPDecoder':
+        """
+        Reconstrói um decoder a partir dos arrays e escalares já calculados,
+        sem precisar do DataFrame da instância.
+        """
+        decoder = cls.__new__(cls)
+        decoder.instance = None
+        decoder.referencia = None
+        decoder.perfil = PERFIL_DESLIGADO
+        for nome, valor in escalares.items():
+            setattr(decoder, nome, valor)
+        for nome, array in arrays.items():
+            setattr(decoder, nome, array)
+        return decoder
+
+    def estado(self) -> tuple:
+        arrays = {nome: getattr(self, nome) for nome in self.ARRAYS}
+        escalares = {nome: getattr(self, nome) for nome in self.ESCALARES}
+        return arrays, escalares
 
     ###########################################################################
 
     def decode(self, chromosome: BaseChromosome, rewrite: bool) -> float:
+        return float(self.decode_lote([chromosome], rewrite)[0])
+
+    ###########################################################################
 
-        self.instance.df = self.df_original.copy()
-        
-        #transforma os cromossomos recebidos para 0 e 1 
-        cromossomos = [1 if value > 0.5 else 0 for value in chromosome]
+    def decode_lote(self, cromossomos, rewrite: bool = False) -> np.ndarray:
+        """
+        Avalia uma população inteira (cromossomos x genes) e devolve o vetor de fitness.
+        Os cromossomos são convertidos em blocos para limitar a memória usada.
+        Com rewrite, os cromossomos são antes reparados por reescrever().
+        """
+        if rewrite:
+            cromossomos = self.reescrever(cromossomos)
+        fitness = np.empty(len(cromossomos))
+        tamanho_bloco = self.cromossomos_por_bloco()
+        for inicio in range(0, len(cromossomos), tamanho_bloco):
+            bloco = self.discretizar(cromossomos[inicio:inicio+tamanho_bloco])
+            fitness[inicio:inicio+len(bloco)] = self.avaliar_bloco(bloco)
+        return fitness
 
-        #multiplica as variáveis pelos cromossomos.
-        colunas = ['Compr_Renda', 'Nivel_Escolaridade', 'Estado_Civil', 'Regiao', 'Nivel_Risco_Novo']
-        self.instance.df[colunas] = self.instance.df[colunas]*cromossomos[0:self.qtd_variaveis]
+    def cromossomos_por_bloco(self) -> int:
+        #elementos de cada cromossomo no bloco: os genes dos clientes (ou chaves) e as tabelas por
+        #chave que contar_bloco() monta para ele
+        largura = self.tamanho_cromossomo - self.qtd_variaveis
+        if self.codificacao == CODIFICACAO_COMPACTA:
+            largura += self.qtd_chaves*(self.qtd_grupos + 1)
+        elif self.codificacao == CODIFICACAO_CHAVES:
+            largura += self.qtd_chaves*(2*self.qtd_taxas + self.qtd_grupos)
+        return max(1, self.elementos_por_bloco // largura)
 
-        
-        cromossomos = np.matrix(cromossomos[self.qtd_variaveis:])
-        cromossomos = cromossomos.reshape(len(self.instance.df.index),self.qtd_grupos)
+    def discretizar(self, cromossomos) -> np.ndarray:
+        """
+        Converte as chaves aleatórias na solução que o decode realmente lê: bits
+        (cortados em 0.5) na codificação por grupos; na compacta e na por chaves,
+        os genes das variáveis viram 0/1 e o de cada cliente (ou chave), o grupo
+        (0 é sem grupo). Genes guardados em inteiros (ver quantizar()) são lidos
+        sem passar para chaves, com o mesmo resultado das chaves que representam.
+        Cromossomos com o mesmo resultado têm o mesmo fitness.
+        """
+        with self.perfil.etapa("conversao"):
+            cromossomos = np.asarray(cromossomos)
+            quantizados = cromossomos.dtype.kind == 'u'
+            #(q + 0.5) / 2**b > 0.5 equivale a q > 2**(b-1) - 1
+            niveis = 2**(8*cromossomos.dtype.itemsize) if quantizados else 0
+            corte = niveis//2 - 1 if quantizados else 0.5
+            if self.codificacao == CODIFICACAO_GRUPOS:
+                #transforma os cromossomos recebidos para 0 e 1
+                return cromossomos > corte
 
-        #Gera as chaves
-        self.instance.df["CHAVE"] = self.instance.df[colunas].apply(self.calcular_chave, axis=1)
-        self.instance.df.reset_index()
+            discretos = np.empty(cromossomos.shape, dtype=np.uint8)
+            discretos[:, 0:self.qtd_variaveis] = cromossomos[:, 0:self.qtd_variaveis] > corte
+            if quantizados:
+                #a faixa de cada código, floor((q + 0.5) / 2**b * (qtd_grupos+1)), vem de uma tabela
+                codigos = np.arange(niveis, dtype=np.int64)
+                tabela = np.minimum((2*codigos + 1)*(self.qtd_grupos + 1) // (2*niveis), self.qtd_grupos)
+                np.take(tabela.astype(np.uint8), cromossomos[:, self.qtd_variaveis:],
+                        out=discretos[:, self.qtd_variaveis:], mode='clip')
+            else:
+                faixas = cromossomos[:, self.qtd_variaveis:] * (self.qtd_grupos + 1)
+                np.minimum(faixas, self.qtd_grupos, out=discretos[:, self.qtd_variaveis:], casting='unsafe')
+            return discretos
+
+    def reescrever(self, cromossomos) -> np.ndarray:
+        """
+        Repara os cromossomos no lugar: cada chave (da máscara escolhida) vai
+        inteira para o grupo em que a maioria dos seus clientes está, e os
+        clientes sem grupo vão com a sua chave, então não sobra penalidade. Os
+        grupos são então renumerados na ordem em que aparecem nas chaves, o
+        que leva soluções viáveis com os rótulos dos grupos trocados à mesma
+        solução discretizada (empates na maioria ficam com o menor rótulo).
+        Os genes mudam o mínimo: o gene que já tem o valor certo é mantido, e
+        os demais guardam a posição dentro da faixa.
+        Devolve os cromossomos reescritos (cromossomos x genes). Como no
+        decode_lote(), são tratados em blocos de cromossomos_por_bloco().
+        """
+        tipo = cromossomos.dtype if isinstance(cromossomos, np.ndarray) else np.float64
+        matriz = cromossomos if isinstance(cromossomos, np.ndarray) else np.array(cromossomos, dtype=tipo)
+        tamanho_bloco = self.cromossomos_por_bloco()
+        for inicio in range(0, len(matriz), tamanho_bloco):
+            matriz[inicio:inicio+tamanho_bloco] = self.reescrever_bloco(matriz[inicio:inicio+tamanho_bloco], tipo)
+
+        if not isinstance(cromossomos, np.ndarray):
+            for cromossomo, linha in zip(cromossomos, matriz.tolist()):
+                cromossomo[:] = linha
+        return matriz
+
+    def reescrever_bloco(self, cromossomos: np.ndarray, tipo) -> np.ndarray:
+        #repara um bloco e o devolve no tipo `tipo`
+        genes = desquantizar(cromossomos)
+        discretos = self.discretizar(genes)
+        for linha, discreto in zip(genes, discretos):
+            self.reescrever_cromossomo(linha, discreto)
+
+        #confere e corrige o arredondamento (e a conversão para o tipo guardado): um gene que caiu
+        #fora da faixa vai para o meio dela
+        alvo = discretos
+        genes = quantizar(genes, tipo)
+        discretos = self.discretizar(genes)
+        errados = discretos != alvo
+        if errados.any():
+            qtd_codigos = 2 if self.codificacao == CODIFICACAO_GRUPOS else self.qtd_grupos + 1
+            errados[:, 0:self.qtd_variaveis] = False
+            genes[errados] = quantizar((alvo[errados].astype(np.float64) + 0.5) / qtd_codigos, tipo)
+        return genes
+
+    def reescrever_cromossomo(self, genes: np.ndarray, discreto: np.ndarray):
+        #genes e discreto de um cromossomo; ambos são reescritos (discreto fica com a solução reparada)
+        qtd_grupos = self.qtd_grupos
+        indice_mascara = discreto[0:self.qtd_variaveis].astype(bool) @ self.pesos_mascara
+        chave = self.chaves_por_mascara[indice_mascara].astype(np.int64)
+        qtd_chaves = np.count_nonzero(self.clientes_por_chave[indice_mascara])
+
+        #grupo (0..qtd_grupos-1) de cada chave; empates e chaves sem nenhum cliente em grupo ficam com o menor
+        if self.codificacao == CODIFICACAO_CHAVES:
+            grupo_chave = np.maximum(discreto[self.qtd_variaveis:self.qtd_variaveis+qtd_chaves].astype(np.int64) - 1, 0)
+        elif self.codificacao == CODIFICACAO_GRUPOS:
+            membros = discreto[self.qtd_variaveis:].reshape(self.qtd_clientes, qtd_grupos)
+            indice = (chave[:, None]*qtd_grupos + self.deslocamento_grupo).ravel()
+            votos = np.bincount(indice, weights=(membros * self.peso_cliente[:, None]).ravel(), minlength=qtd_chaves*qtd_grupos)
+            grupo_chave = votos.reshape(qtd_chaves, qtd_grupos).argmax(axis=1)
+        else:
+            codigo = discreto[self.qtd_variaveis:].astype(np.int64)
+            com_grupo = codigo > 0
+            indice = chave[com_grupo]*qtd_grupos + codigo[com_grupo] - 1
+            votos = np.bincount(indice, weights=self.peso_cliente[com_grupo], minlength=qtd_chaves*qtd_grupos)
+            grupo_chave = votos.reshape(qtd_chaves, qtd_grupos).argmax(axis=1)
 
-        #Cria um dataframe de cromossomos G1,G2,G3 e G4
-        colunas_grupos = [f"G{i+1}" for i in range(0, self.qtd_grupos)]
-        cromossomos_df = pd.DataFrame(cromossomos, columns=colunas_grupos)
-        cromossomos_df.reset_index()
+        #renumera os grupos na ordem da primeira chave de cada um; os vazios ficam com os últimos rótulos
+        usados, primeira = np.unique(grupo_chave, return_index=True)
+        ordem = np.concatenate([usados[np.argsort(primeira)], np.setdiff1d(np.arange(qtd_grupos), usados)])
+        rotulo = np.empty(qtd_grupos, dtype=np.int64)
+        rotulo[ordem] = np.arange(qtd_grupos)
+        grupo_chave = rotulo[grupo_chave]
 
-        self.instance.df = pd.concat([self.instance.df, cromossomos_df], axis=1)
+        if self.codificacao == CODIFICACAO_GRUPOS:
+            #leva o gene de cada grupo para a coluna do novo rótulo e espelha (v -> 1-v) os bits errados
+            bloco = genes[self.qtd_variaveis:].reshape(self.qtd_clientes, qtd_grupos)
+            renumerado = np.empty_like(bloco)
+            renumerado[:, rotulo] = bloco
+            desejado = self.deslocamento_grupo == grupo_chave[chave][:, None]
+            errado = (renumerado > 0.5) != desejado
+            renumerado[errado] = 1 - renumerado[errado]
+            bloco[...] = renumerado
+            discreto[self.qtd_variaveis:] = desejado.ravel()
+        else:
+            if self.codificacao == CODIFICACAO_CHAVES:
+                #as chaves que a máscara não tem ficam com o código 0, para que a forma canônica seja única
+                trecho = slice(self.qtd_variaveis, None)
+                codigo = np.zeros(self.qtd_chaves, dtype=np.int64)
+                codigo[:qtd_chaves] = grupo_chave + 1
+            else:
+                trecho = slice(self.qtd_variaveis, None)
+                codigo = grupo_chave[chave] + 1
+            #mantém a posição de cada gene dentro da faixa do código antigo
+            qtd_codigos = qtd_grupos + 1
+            posicao = np.clip(genes[trecho]*qtd_codigos - discreto[trecho], 0, 1)
+            genes[trecho] = (codigo + posicao) / qtd_codigos
+            discreto[trecho] = codigo
 
-        self.instance.df["PENALIDADE"] = self.instance.df[colunas_grupos].apply(self.calcular_penalizacao, axis=1)
+    def avaliar_discretos(self, discretos: np.ndarray) -> np.ndarray:
+        """
+        Avalia cromossomos já convertidos por discretizar().
+        """
+        fitness = np.empty(len(discretos))
+        tamanho_bloco = self.cromossomos_por_bloco()
+        for inicio in range(0, len(discretos), tamanho_bloco):
+            fitness[inicio:inicio+tamanho_bloco] = self.avaliar_bloco(discretos[inicio:inicio+tamanho_bloco])
+        return fitness
 
-        penalidade_cliente = self.instance.df["PENALIDADE"].sum()        
+    def componentes_discretos(self, discretos: np.ndarray) -> np.ndarray:
+        """
+        Como avaliar_discretos(), mas devolve as parcelas do fitness
+        (cromossomos x 3): a soma das diferenças entre os alfas, a penalidade
+        dos clientes e a penalidade das chaves divididas entre grupos.
+        """
+        componentes = np.empty((len(discretos), 3))
+        tamanho_bloco = self.cromossomos_por_bloco()
+        for inicio in range(0, len(discretos), tamanho_bloco):
+            tabelas = self.contar_bloco(discretos[inicio:inicio+tamanho_bloco])
+            componentes[inicio:inicio+tamanho_bloco] = np.column_stack(self.calcular_componentes(*tabelas))
+        return componentes
 
-        #cria um dataframe com a multiplicação da coluna dos grupos pela coluna "Flag_Efet"
-        for i in range(0,self.qtd_grupos):
-            self.instance.df[f"E{i+1}"] = self.instance.df[f"G{i+1}"] * self.instance.df["Flag_Efet"]
+    def avaliar_bloco(self, cromossomos: np.ndarray) -> np.ndarray:
+        return self.calcular_fitness(*self.contar_bloco(cromossomos))
 
-        #Conta a quantidade de grupos por taxa
-        ls_contagem = []
-        for i in range(0, self.qtd_grupos):
-            result = self.instance.df.groupby([f"G{i+1}", "Taxa"]).size().drop(0)
-            ls_contagem.append(result)
-        ls_contagem = np.array(ls_contagem)
+    def contar_bloco(self, cromossomos: np.ndarray) -> tuple:
+        #devolve as tabelas de calcular_fitness(): contagem, matriz e penalidade_cliente
+        if self.codificacao == CODIFICACAO_COMPACTA:
+            return self.contar_bloco_compacto(cromossomos)
+        if self.codificacao == CODIFICACAO_CHAVES:
+            return self.contar_bloco_chaves(cromossomos)
 
-        tabela_unificada = pd.DataFrame(ls_contagem, columns=self.instance.df['Taxa'].unique().tolist())
+        qtd = len(cromossomos)
+        mascaras = cromossomos[:, 0:self.qtd_variaveis]
+        grupos = cromossomos[:, self.qtd_variaveis:].reshape(qtd, self.qtd_clientes, self.qtd_grupos)
 
-        #conta a quantidade de efetivados por taxa
-        ls_efetivados = []
-        for i in range(0, self.qtd_grupos):
-            result = self.instance.df.groupby([f"E{i+1}", "Taxa"]).size().drop(0)
-            ls_efetivados.append(result)
-        ls_efetivados = np.array(ls_efetivados)
+        #Gera as chaves
+        with self.perfil.etapa("chaves"):
+            chaves = self.calcular_chave(mascaras)
 
-        tabela_efetivados = pd.DataFrame(ls_efetivados, columns=self.instance.df['Taxa'].unique().tolist())
+        with self.perfil.etapa("penalidade_cliente"):
+            penalidade_cliente = self.calcular_penalizacao(grupos.sum(axis=2)) @ self.peso_cliente
 
-        #gera a tabela de percentual grupo por taxa
-        divisao = tabela_efetivados.div(tabela_unificada).reset_index()
-        divisao = divisao.apply(lambda c: round(c,3))
+        #conta, em um único produto, clientes e efetivados de cada grupo por taxa
+        with self.perfil.etapa("contagem_taxas"):
+            contagem = np.matmul(self.indicadora_taxa.T, grupos.astype(self.tipo_contagem)).transpose(0, 2, 1)
 
         #conta a quantidade de grupos cada cliente com a mesma chave participa
-        df_melt = self.instance.df.melt(id_vars='CHAVE', value_vars=colunas_grupos, value_name='presenca')
-        contagem_grupos = df_melt.groupby(['CHAVE', 'variable']).agg(sum_presenca=('presenca', 'sum')).unstack()
-        contagem_grupos.columns = ['_'.join(col) for col in contagem_grupos.columns]
+        with self.perfil.etapa("contagem_chaves"):
+            chaves = chaves + self.qtd_chaves*np.arange(qtd, dtype=np.int64)[:, None]
+            indice_chave = (chaves[:, :, None]*self.qtd_grupos + self.deslocamento_grupo).ravel()
+            pesos = (grupos * self.peso_cliente[:, None]).ravel()
+            matriz = np.bincount(indice_chave, weights=pesos, minlength=qtd*self.qtd_chaves*self.qtd_grupos)
+            matriz = matriz.reshape(qtd, self.qtd_chaves, self.qtd_grupos)
+
+        return contagem, matriz, penalidade_cliente
+
+    def contar_bloco_compacto(self, cromossomos: np.ndarray) -> tuple:
+        #cada cliente está em no máximo um grupo: as contagens saem direto do código do grupo,
+        #e só os clientes sem grupo são penalizados
+        qtd = len(cromossomos)
+        mascaras = cromossomos[:, 0:self.qtd_variaveis].astype(bool)
+        grupo = cromossomos[:, self.qtd_variaveis:].astype(np.int64)
+        qtd_codigos = self.qtd_grupos + 1
+
+        with self.perfil.etapa("chaves"):
+            chaves = self.calcular_chave(mascaras)
+
+        with self.perfil.etapa("penalidade_cliente"):
+            penalidade_cliente = 100*((grupo == 0) @ self.peso_cliente)
+
+        with self.perfil.etapa("contagem_taxas"):
+            grupo_cromossomo = grupo + qtd_codigos*np.arange(qtd, dtype=np.int64)[:, None]
+            indice_taxa = (grupo_cromossomo*self.qtd_taxas + self.codigo_taxa).ravel()
+            tamanho = qtd*qtd_codigos*self.qtd_taxas
+            tabela_unificada = np.bincount(indice_taxa, weights=np.broadcast_to(self.peso_cliente, grupo.shape).ravel(), minlength=tamanho)
+            tabela_efetivados = np.bincount(indice_taxa, weights=np.broadcast_to(self.flag_efet, grupo.shape).ravel(), minlength=tamanho)
+            contagem = np.concatenate([
+                tabela_unificada.reshape(qtd, qtd_codigos, self.qtd_taxas),
+                tabela_efetivados.reshape(qtd, qtd_codigos, self.qtd_taxas)], axis=2)[:, 1:]
+
+        with self.perfil.etapa("contagem_chaves"):
+            chaves = chaves + self.qtd_chaves*np.arange(qtd, dtype=np.int64)[:, None]
+            indice_chave = (chaves*qtd_codigos + grupo).ravel()
+            matriz = np.bincount(indice_chave, weights=np.broadcast_to(self.peso_cliente, grupo.shape).ravel(), minlength=qtd*self.qtd_chaves*qtd_codigos)
+            matriz = matriz.reshape(qtd, self.qtd_chaves, qtd_codigos)[:, :, 1:]
+
+        return contagem, matriz, penalidade_cliente
+
+    def contar_bloco_chaves(self, cromossomos: np.ndarray) -> tuple:
+        #o grupo é escolhido por chave: as contagens saem das tabelas pré-somadas da máscara,
+        #e o custo não depende da quantidade de clientes
+        qtd = len(cromossomos)
+        mascaras = cromossomos[:, 0:self.qtd_variaveis].astype(bool)
+        grupo = cromossomos[:, self.qtd_variaveis:].astype(np.int64)
+        qtd_codigos = self.qtd_grupos + 1
 
-        listas = []
-        for i in range(0, self.qtd_grupos):
-            listas.append(contagem_grupos[f"sum_presenca_G{i+1}"].to_list())
-        
-        matriz = np.matrix(listas)
-        matriz = matriz.transpose()
+        with self.perfil.etapa("chaves"):
+            indice_mascara = mascaras @ self.pesos_mascara
+            taxas_por_chave = self.taxas_por_chave[indice_mascara]
 
+        #as chaves que a máscara não tem não têm clientes, então não contam
+        with self.perfil.etapa("penalidade_cliente"):
+            penalidade_cliente = 100*(self.clientes_por_chave[indice_mascara] * (grupo == 0)).sum(axis=1)
+
+        with self.perfil.etapa("contagem_taxas"):
+            indicadora_grupo = grupo[:, :, None] == np.arange(1, qtd_codigos)
+            contagem = np.matmul(indicadora_grupo.transpose(0, 2, 1).astype(np.float64), taxas_por_chave)
+
+        #clientes com a mesma chave nunca se separam: a matriz de chaves fica vazia
+        matriz = np.zeros((qtd, 1, self.qtd_grupos))
+        return contagem, matriz, penalidade_cliente
+
+    def calcular_fitness(self, contagem, matriz, penalidade_cliente) -> np.ndarray:
+        """
+        Calcula o fitness a partir das tabelas já contadas de cada cromossomo:
+        contagem (cromossomos x grupos x 2*taxas), matriz (cromossomos x chaves x grupos)
+        e penalidade_cliente (cromossomos).
+        """
+        soma, penalidade_cliente, penalidade_grupo = self.calcular_componentes(contagem, matriz, penalidade_cliente)
+        return soma + penalidade_cliente + penalidade_grupo
+
+    def calcular_componentes(self, contagem, matriz, penalidade_cliente) -> tuple:
+        #parcelas do fitness, com as mesmas tabelas de calcular_fitness()
         #verifica se clientes com a mesma chave estão em mais de um grupo
-        penalidade_grupo = 0
-        fator_penalidade = 1000
-        for item in matriz:
-            soma_grupo_chave = sum(item.tolist()[0])
-            diferenca_soma_maior = soma_grupo_chave - max(item.tolist()[0])
-            if diferenca_soma_maior != 0:
-                penalidade_grupo += fator_penalidade * (diferenca_soma_maior / soma_grupo_chave)
-        
+        with self.perfil.etapa("penalidade_chave"):
+            fator_penalidade = 1000
+            matriz = matriz.astype(np.float64, copy=False)
+            soma_grupo_chave = matriz.sum(axis=2)
+            diferenca_soma_maior = soma_grupo_chave - matriz.max(axis=2)
+            proporcao = np.divide(diferenca_soma_maior, soma_grupo_chave, out=np.zeros_like(diferenca_soma_maior), where=diferenca_soma_maior != 0)
+            penalidade_grupo = (fator_penalidade * proporcao).sum(axis=1)
+
         #se eu quero minimizar, significa que a penalidade deve ser negativa, pois o resultado será positivo para gerações penalizadas
         #se eu quero maximizar, a penalizade deve ser positiva, pois o valor negativo vai ser multiplicado por um fator positivo, diminuindo o número
 
-        #se os clientes não estão em mais de um grupo, calcula o alfa
-        divisao["Alfa"] = divisao.apply(lambda row: self.calcular_alfa(row, self.instance.df['Taxa'].unique().tolist()), axis=1)
-        #converte o alfa e ordena
-        item = divisao["Alfa"].to_list()
-        item.sort()
-
-        #calcula a diferença entre os alfas
-        soma = 0
-        for idx in range(0,len(item)-1):
-            soma += round(item[idx+1],2) - round(item[idx],2)
-        
-        return soma + penalidade_cliente + penalidade_grupo
\ No newline at end of file
+        with self.perfil.etapa("alfa"):
+            contagem = contagem.astype(np.float64)
+            tabela_unificada = contagem[:, :, :self.qtd_taxas]
+            tabela_efetivados = contagem[:, :, self.qtd_taxas:]
+
+            #gera a tabela de percentual grupo por taxa (taxas sem clientes no grupo ficam com 0)
+            divisao = np.divide(tabela_efetivados, tabela_unificada, out=np.zeros_like(tabela_efetivados), where=tabela_unificada > 0)
+            divisao = np.round(divisao, 3)
+
+            #se os clientes não estão em mais de um grupo, calcula o alfa
+            alfas = self.calcular_alfa(divisao)
+
+            #calcula a diferença entre os alfas ordenados
+            soma = np.empty(len(alfas))
+            for i, item in enumerate(alfas.tolist()):
+                item.sort()
+                soma[i] = sum(round(item[idx+1],2) - round(item[idx],2) for idx in range(0,len(item)-1))
+
+        return soma, penalidade_cliente, penalidade_grupo
+
+    ###########################################################################
+
+    def definir_referencia(self, chromosome: BaseChromosome) -> float:
+        """
+        Guarda as tabelas de contagem do cromossomo de referência (por exemplo,
+        um pai da elite) para decode_incremental() e devolve o seu fitness.
+        Disponível apenas na codificação por grupos.
+        """
+        if self.codificacao != CODIFICACAO_GRUPOS:
+            raise ValueError("A avaliação incremental só existe na codificação por grupos")
+
+        bits = self.discretizar(np.asarray(chromosome)[None])[0]
+        grupos = bits[self.qtd_variaveis:].reshape(self.qtd_clientes, self.qtd_grupos)
+        chave = self.calcular_chave(bits[None, 0:self.qtd_variaveis])[0]
+        soma_cliente = grupos.sum(axis=1)
+
+        contagem = (self.indicadora_taxa.T @ grupos.astype(self.tipo_contagem)).T.astype(np.float64)
+        indice_chave = (chave[:, None].astype(np.int64)*self.qtd_grupos + self.deslocamento_grupo).ravel()
+        matriz = np.bincount(indice_chave, weights=(grupos * self.peso_cliente[:, None]).ravel(), minlength=self.qtd_chaves*self.qtd_grupos)
+        matriz = matriz.reshape(self.qtd_chaves, self.qtd_grupos)
+        penalidade_cliente = self.calcular_penalizacao(soma_cliente) @ self.peso_cliente
+
+        self.referencia = {
+            'bits': bits,
+            'chave': chave,
+            'soma_cliente': soma_cliente,
+            'contagem': contagem,
+            'matriz': matriz,
+            'penalidade_cliente': penalidade_cliente,
+        }
+        return float(self.calcular_fitness(contagem[None], matriz[None], np.array([penalidade_cliente]))[0])
+
+    def decode_incremental(self, chromosome: BaseChromosome, atualizar: bool = False) -> float:
+        """
+        Avalia um cromossomo a partir da referência, atualizando as tabelas só
+        para os genes cujo bit (após o corte em 0.5) mudou. Se algum gene das
+        variáveis mudou, todas as chaves mudam e o cromossomo é avaliado do zero.
+        Com atualizar=True, o cromossomo passa a ser a nova referência.
+        """
+        if self.referencia is None:
+            raise RuntimeError("Defina a referência com definir_referencia() antes de usar decode_incremental()")
+
+        ref = self.referencia
+        bits = self.discretizar(np.asarray(chromosome)[None])[0]
+        alterados = np.flatnonzero(bits != ref['bits'])
+
+        if alterados.size and alterados[0] < self.qtd_variaveis:
+            if atualizar:
+                return self.definir_referencia(chromosome)
+            return self.decode(chromosome, False)
+
+        genes = alterados - self.qtd_variaveis
+        clientes = genes // self.qtd_grupos
+        grupos = genes % self.qtd_grupos
+        sinal = np.where(bits[alterados], 1, -1)
+
+        contagem = ref['contagem'].copy()
+        taxas = self.codigo_taxa[clientes]
+        np.add.at(contagem, (grupos, taxas), sinal*self.peso_cliente[clientes])
+        np.add.at(contagem, (grupos, self.qtd_taxas + taxas), sinal*self.flag_efet[clientes])
+
+        matriz = ref['matriz'].copy()
+        np.add.at(matriz, (ref['chave'][clientes], grupos), sinal*self.peso_cliente[clientes])
+
+        #só a penalidade dos clientes alterados muda
+        afetados, posicao = np.unique(clientes, return_inverse=True)
+        soma_antiga = ref['soma_cliente'][afetados]
+        soma_nova = soma_antiga + np.bincount(posicao, weights=sinal, minlength=len(afetados)).astype(soma_antiga.dtype)
+        peso = self.peso_cliente[afetados]
+        penalidade_cliente = ref['penalidade_cliente'] \
+            - self.calcular_penalizacao(soma_antiga) @ peso + self.calcular_penalizacao(soma_nova) @ peso
+
+        if atualizar:
+            soma_cliente = ref['soma_cliente'].copy()
+            soma_cliente[afetados] = soma_nova
+            self.referencia = {
+                'bits': bits,
+                'chave': ref['chave'],
+                'soma_cliente': soma_cliente,
+                'contagem': contagem,
+                'matriz': matriz,
+                'penalidade_cliente': penalidade_cliente,
+            }
+
+        return float(self.calcular_fitness(contagem[None], matriz[None], np.array([penalidade_cliente]))[0])
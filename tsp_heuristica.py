@@ -0,0 +1,153 @@
+###############################################################################
+# tsp_heuristica.py: greedy construction of feasible solutions, encoded as
+# chromosomes to seed the initial population.
+#
+# This code is released under LICENSE.md.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+###############################################################################
+
+import numpy as np
+
+from tsp_decoder import TSPDecoder, CODIFICACAO_GRUPOS, CODIFICACAO_COMPACTA
+
+#margem em torno dos cortes dos genes, para que a solução sobreviva ao arredondamento
+MARGEM_GENE = 0.05
+
+def tabela_por_chave(decoder: TSPDecoder, mascara: int) -> tuple:
+    """
+    Devolve, para as chaves da máscara, a tabela chaves x (taxas, taxas dos
+    efetivados), como as linhas de indicadora_taxa somadas por chave, e a
+    quantidade de clientes de cada chave.
+    """
+    clientes = decoder.clientes_por_chave[mascara]
+    qtd_chaves = np.count_nonzero(clientes)
+    chave = decoder.chaves_por_mascara[mascara].astype(np.int64)
+    indice_taxa = chave*decoder.qtd_taxas + decoder.codigo_taxa
+    tamanho = qtd_chaves*decoder.qtd_taxas
+    tabela = np.concatenate([
+        np.bincount(indice_taxa, weights=decoder.peso_cliente, minlength=tamanho).reshape(qtd_chaves, decoder.qtd_taxas),
+        np.bincount(indice_taxa, weights=decoder.flag_efet, minlength=tamanho).reshape(qtd_chaves, decoder.qtd_taxas)],
+        axis=1)
+    return tabela, clientes[:qtd_chaves]
+
+def avaliar_movimentos(decoder: TSPDecoder, contagem: np.ndarray, linha: np.ndarray) -> np.ndarray:
+    #fitness de somar a linha de uma chave a cada um dos grupos; com todas as chaves inteiras em um grupo,
+    #só o alfa conta
+    qtd_grupos = decoder.qtd_grupos
+    candidatos = np.repeat(contagem[None], qtd_grupos, axis=0)
+    candidatos[np.arange(qtd_grupos), np.arange(qtd_grupos)] += linha
+    return decoder.calcular_fitness(candidatos, np.zeros((qtd_grupos, 1, qtd_grupos)), np.zeros(qtd_grupos))
+
+def construir_grupos(decoder: TSPDecoder, tabela: np.ndarray, ordem: np.ndarray) -> tuple:
+    """
+    Distribui as chaves entre os grupos: as qtd_grupos primeiras da ordem
+    abrem um grupo cada; as demais vão, uma a uma, para o grupo que deixa o
+    menor fitness parcial. Depois, uma passada move cada chave para outro
+    grupo quando isso melhora o fitness sem esvaziar o grupo de origem.
+    Devolve o grupo (0..qtd_grupos-1) de cada chave e o fitness final.
+    """
+    qtd_grupos = decoder.qtd_grupos
+    grupo_chave = np.zeros(len(tabela), dtype=np.int64)
+    contagem = np.zeros((qtd_grupos, tabela.shape[1]))
+    chaves_grupo = np.zeros(qtd_grupos, dtype=np.int64)
+
+    for posicao, chave in enumerate(ordem):
+        if posicao < qtd_grupos:
+            grupo = posicao
+        else:
+            grupo = int(np.argmin(avaliar_movimentos(decoder, contagem, tabela[chave])))
+        grupo_chave[chave] = grupo
+        contagem[grupo] += tabela[chave]
+        chaves_grupo[grupo] += 1
+
+    fitness = float(avaliar_movimentos(decoder, contagem, np.zeros(tabela.shape[1]))[0])
+    for chave in ordem:
+        origem = grupo_chave[chave]
+        if chaves_grupo[origem] == 1:
+            continue
+        contagem[origem] -= tabela[chave]
+        movimentos = avaliar_movimentos(decoder, contagem, tabela[chave])
+        grupo = int(np.argmin(movimentos))
+        if movimentos[grupo] >= fitness:
+            grupo = origem
+        else:
+            fitness = float(movimentos[grupo])
+        grupo_chave[chave] = grupo
+        contagem[grupo] += tabela[chave]
+        chaves_grupo[origem] -= 1
+        chaves_grupo[grupo] += 1
+
+    return grupo_chave, fitness
+
+def codificar(decoder: TSPDecoder, mascara: int, grupo_chave: np.ndarray, rng: np.random.Generator) -> list:
+    """
+    Codifica a solução (máscara e grupo de cada chave) como um cromossomo da
+    codificação do decoder, sorteando cada gene dentro da faixa que o
+    discretizar() lê como o valor desejado.
+    """
+    qtd_grupos = decoder.qtd_grupos
+
+    def faixa(codigo, qtd_codigos):
+        return (codigo + rng.uniform(MARGEM_GENE, 1 - MARGEM_GENE, np.shape(codigo))) / qtd_codigos
+
+    bits = (mascara & decoder.pesos_mascara) > 0
+    genes = [faixa(bits.astype(np.int64), 2)]
+
+    if decoder.codificacao == CODIFICACAO_GRUPOS or decoder.codificacao == CODIFICACAO_COMPACTA:
+        grupo_cliente = grupo_chave[decoder.chaves_por_mascara[mascara]]
+        if decoder.codificacao == CODIFICACAO_GRUPOS:
+            indicadora = np.arange(qtd_grupos) == grupo_cliente[:, None]
+            genes.append(faixa(indicadora.astype(np.int64), 2).ravel())
+        else:
+            genes.append(faixa(grupo_cliente + 1, qtd_grupos + 1))
+    else:
+        #as chaves que a máscara não tem não são lidas: ficam aleatórias
+        resto = rng.random(decoder.qtd_chaves - len(grupo_chave))
+        genes.append(np.concatenate([faixa(grupo_chave + 1, qtd_grupos + 1), resto]))
+
+    return np.concatenate(genes).tolist()
+
+def gerar_cromossomos(decoder: TSPDecoder, quantidade: int, seed: int) -> list:
+    """
+    Gera `quantidade` cromossomos viáveis (cada cliente em um grupo e as
+    chaves inteiras), do melhor para o pior fitness. A primeira rodada
+    constrói uma solução por máscara, com as chaves em ordem decrescente de
+    clientes; as seguintes repetem as máscaras com as chaves em ordem
+    aleatória.
+    """
+    rng = np.random.default_rng(seed)
+    qtd_mascaras = len(decoder.chaves_por_mascara)
+    tabelas = [tabela_por_chave(decoder, mascara) for mascara in range(qtd_mascaras)]
+
+    solucoes = []
+    rodada = 0
+    while len(solucoes) < quantidade:
+        candidatas = []
+        for mascara, (tabela, clientes) in enumerate(tabelas):
+            if len(tabela) < decoder.qtd_grupos:
+                continue
+            if rodada == 0:
+                ordem = np.argsort(-clientes, kind='stable')
+            else:
+                ordem = rng.permutation(len(tabela))
+            grupo_chave, fitness = construir_grupos(decoder, tabela, ordem)
+            candidatas.append((fitness, mascara, grupo_chave))
+        if not candidatas:
+            break
+        candidatas.sort(key=lambda candidata: candidata[0])
+        solucoes.extend(candidatas[:quantidade - len(solucoes)])
+        rodada += 1
+
+    solucoes.sort(key=lambda solucao: solucao[0])
+    return [codificar(decoder, mascara, grupo_chave, rng) for _, mascara, grupo_chave in solucoes]
@@ -0,0 +1,222 @@
+###############################################################################
+# tsp_ilhas.py: island model, with each independent population evolving in
+# its own process and elite migration at the exchange interval.
+#
+# This code is released under LICENSE.md.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+###############################################################################
+
+from multiprocessing import Pipe, Process
+import copy
+import traceback
+
+from brkga_mp_ipr.enums import Sense
+from brkga_mp_ipr.types import BrkgaParams
+import numpy as np
+
+from tsp_brkga import BrkgaMpIprLote
+from tsp_cache import CacheFitness
+from tsp_decoder import TSPDecoder
+from tsp_paralelo import anexar_decoder, publicar_estado
+
+def _executar_ilha(conexao, descricao: dict, escalares: dict, params: BrkgaParams,
+                   sense: Sense, semente: int, cache_fitness_mb: int, iniciais: list,
+                   reescrever: bool, armazenamento: str):
+    #cada ilha tem uma única população, decodificada no próprio processo;
+    #todo comando recebe uma resposta ("ok", valor) ou ("erro", traceback)
+    try:
+        decoder = anexar_decoder(descricao, escalares)
+        cache = None
+        if cache_fitness_mb > 0:
+            decoder = cache = CacheFitness(decoder, cache_fitness_mb)
+
+        brkga = BrkgaMpIprLote(
+            decoder=decoder,
+            sense=sense,
+            seed=semente,
+            chromosome_size=escalares['tamanho_cromossomo'],
+            params=params,
+            reescrever=reescrever,
+            armazenamento=armazenamento
+        )
+        if iniciais:
+            brkga.set_initial_population(iniciais)
+        brkga.initialize()
+        conexao.send(("ok", None))
+
+        while True:
+            comando, argumento = conexao.recv()
+            if comando == "evoluir":
+                brkga.evolve(argumento)
+                resposta = brkga.get_best_fitness()
+            elif comando == "elite":
+                elite = brkga.elite(0, argumento)
+                resposta = ([valor for valor, _ in elite], np.array([cromossomo for _, cromossomo in elite]))
+            elif comando == "reiniciar":
+                brkga.reiniciar()
+                resposta = None
+            elif comando == "imigrantes":
+                valores, cromossomos = argumento
+                brkga.inserir_imigrantes(0, list(zip(valores, cromossomos.tolist())))
+                resposta = None
+            elif comando == "melhor":
+                resposta = (brkga.get_best_fitness(), np.array(brkga.get_best_chromosome()),
+                            cache.resumo() if cache is not None else None)
+            else:
+                break
+            conexao.send(("ok", resposta))
+    except Exception:
+        conexao.send(("erro", traceback.format_exc()))
+    finally:
+        conexao.close()
+
+class ExecucaoIlhas():
+    """
+    Executa cada população independente do BRKGA em um processo (ilha).
+
+    A instância é lida uma única vez: os arrays do decoder vão para memória
+    compartilhada e cada ilha monta o seu decoder sobre eles. A cada
+    exchange_interval gerações, todas as ilhas param e cada uma recebe, por
+    um Pipe, os num_exchange_indivuduals melhores indivíduos de cada uma das
+    outras, já com o fitness, no lugar dos seus piores. Se pedido, a cada
+    reset_interval gerações (depois da troca, quando coincidem) cada ilha é
+    reiniciada, mantendo só o seu melhor indivíduo.
+
+    Os cromossomos iniciais, se houver, entram na população de todas as
+    ilhas. A ilha i usa a semente seed + i e as trocas acontecem sempre nas
+    mesmas gerações e na mesma ordem, então o resultado de uma semente não
+    depende de como os processos são escalonados.
+    """
+
+    def __init__(self, decoder: TSPDecoder, brkga_params: BrkgaParams, sense: Sense,
+                 seed: int, cache_fitness_mb: int = 0, iniciais: list = None,
+                 reescrever: bool = False, armazenamento: str = "float64"):
+        self.sense = sense
+        self.qtd_ilhas = brkga_params.num_independent_populations
+        self.geracao = 0
+        self.conexoes = []
+        self.processos = []
+
+        params = copy.copy(brkga_params)
+        params.num_independent_populations = 1
+
+        self.memorias, descricao, escalares = publicar_estado(decoder)
+        try:
+            for ilha in range(self.qtd_ilhas):
+                local, remota = Pipe()
+                processo = Process(target=_executar_ilha, daemon=True,
+                                   args=(remota, descricao, escalares, params, sense,
+                                         seed + ilha, cache_fitness_mb, iniciais, reescrever,
+                                         armazenamento))
+                processo.start()
+                remota.close()
+                self.conexoes.append(local)
+                self.processos.append(processo)
+            self._receber_todas()
+        except BaseException:
+            self.fechar()
+            raise
+
+    ###########################################################################
+
+    def _receber(self, ilha: int):
+        try:
+            estado, valor = self.conexoes[ilha].recv()
+        except EOFError:
+            raise RuntimeError(f"Island {ilha} exited unexpectedly") from None
+        if estado == "erro":
+            raise RuntimeError(f"Island {ilha} failed:\n{valor}")
+        return valor
+
+    def _receber_todas(self) -> list:
+        return [self._receber(ilha) for ilha in range(self.qtd_ilhas)]
+
+    def _enviar_todas(self, comando: str, argumento=None) -> list:
+        #envia a todas antes de esperar a primeira, para que trabalhem ao mesmo tempo
+        for conexao in self.conexoes:
+            conexao.send((comando, argumento))
+        return self._receber_todas()
+
+    ###########################################################################
+
+    def evoluir(self, num_generations: int, exchange_interval: int = 0,
+                num_exchange_indivuduals: int = 0, reset_interval: int = 0) -> None:
+        """
+        Evolui todas as ilhas por num_generations gerações, trocando a elite
+        sempre que a geração acumulada for múltipla de exchange_interval e
+        reiniciando as ilhas quando for múltipla de reset_interval (0 não
+        troca ou não reinicia).
+        """
+        trocar = exchange_interval > 0 and num_exchange_indivuduals > 0 and self.qtd_ilhas > 1
+        reiniciar = reset_interval > 0
+        restantes = num_generations
+        while restantes > 0:
+            passo = restantes
+            if trocar:
+                passo = min(passo, exchange_interval - self.geracao % exchange_interval)
+            if reiniciar:
+                passo = min(passo, reset_interval - self.geracao % reset_interval)
+            self._enviar_todas("evoluir", passo)
+            self.geracao += passo
+            restantes -= passo
+
+            if trocar and self.geracao % exchange_interval == 0:
+                self.trocar_elite(num_exchange_indivuduals)
+            if reiniciar and self.geracao % reset_interval == 0:
+                self._enviar_todas("reiniciar")
+
+    def trocar_elite(self, num_immigrants: int) -> None:
+        elites = self._enviar_todas("elite", num_immigrants)
+        for ilha, conexao in enumerate(self.conexoes):
+            outras = [elites[j] for j in range(self.qtd_ilhas) if j != ilha]
+            valores = [valor for valores, _ in outras for valor in valores]
+            cromossomos = np.concatenate([cromossomos for _, cromossomos in outras])
+            conexao.send(("imigrantes", (valores, cromossomos)))
+        self._receber_todas()
+
+    def melhor(self) -> tuple:
+        """
+        Devolve (fitness, cromossomo, resumos) do melhor indivíduo entre as
+        ilhas; resumos traz o resumo do cache de fitness de cada ilha.
+        """
+        melhores = self._enviar_todas("melhor")
+        escolhida = melhores[0]
+        for candidata in melhores[1:]:
+            if (candidata[0] < escolhida[0]) == (self.sense == Sense.MINIMIZE):
+                escolhida = candidata
+        return escolhida[0], escolhida[1], [resumo for _, _, resumo in melhores]
+
+    ###########################################################################
+
+    def fechar(self):
+        for conexao, processo in zip(self.conexoes, self.processos):
+            if processo.is_alive():
+                try:
+                    conexao.send(("fim", None))
+                except OSError:
+                    pass
+            processo.join()
+            conexao.close()
+        self.conexoes = []
+        self.processos = []
+        for memoria in self.memorias:
+            memoria.close()
+            memoria.unlink()
+        self.memorias = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.fechar()
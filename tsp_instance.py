@@ -24,15 +24,104 @@
 
 from pandas import DataFrame
 from brkga_mp_ipr.exceptions import LoadError
+import hashlib
+import json
+import os
+import numpy as np
 import pandas as pd
 
+COLUNAS_SELECIONADAS = ['Compr_Renda', 'Nivel_Escolaridade', 'Taxa', 'Estado_Civil', 'Regiao', 'Flag_Efet', 'Nivel_Risco_Novo']
+
+#códigos das colunas categóricas
+CATEGORIAS = {
+    'Compr_Renda': {
+        "5%-": 1,
+        "5% a 10%": 2,
+        "10% a 15%": 3,
+        "15% a 20%": 4,
+        "20% a 25%": 5,
+        "25% a 30%": 6,
+        "30%+": 7
+    },
+    'Nivel_Escolaridade': {
+        "Med_e_Sup_Inc": 1,
+        "Sup_e_Pos": 2
+    },
+    'Estado_Civil': {
+        "Casado": 1,
+        "Divorciado": 2,
+        "Solteiro": 3,
+        "Viuvo": 4
+    },
+    'Regiao': {
+        "Centro-Oeste": 1,
+        "Nordeste": 2,
+        "Norte": 3,
+        "Sudeste": 4,
+        "Sul": 5
+    },
+}
+
+#formato do cache: MAGICO, tamanho do cabeçalho (uint64), cabeçalho JSON e as colunas alinhadas
+MAGICO_CACHE = b"TSPCACHE"
+VERSAO_CACHE = 2
+ALINHAMENTO_CACHE = 64
+
+def menor_tipo(valores: np.ndarray) -> np.dtype:
+    """
+    Returns the smallest integer dtype that holds the values exactly, or
+    float64 if they are not all integers.
+    """
+    if valores.dtype.kind in "iub":
+        inteiros = valores
+    elif valores.dtype.kind == "f" and np.all(np.isfinite(valores)) and np.all(valores == np.round(valores)):
+        inteiros = valores.astype(np.int64)
+    else:
+        return np.dtype(np.float64)
+    for tipo in (np.int8, np.int16, np.int32):
+        limites = np.iinfo(tipo)
+        if len(inteiros) == 0 or (inteiros.min() >= limites.min and inteiros.max() <= limites.max):
+            return np.dtype(tipo)
+    return np.dtype(np.int64)
+
+def hash_arquivo(filename: str) -> str:
+    resumo = hashlib.blake2b(digest_size=16)
+    with open(filename, "rb") as hd:
+        for bloco in iter(lambda: hd.read(1 << 20), b""):
+            resumo.update(bloco)
+    return resumo.hexdigest()
+
 class TSPInstance():
-    def __init__(self, filename: str):
+    def __init__(self, filename: str, usar_cache: bool = False, tamanho_bloco: int = 0):
         """
         Initializes the instance loading from a file.
+
+        If usar_cache is set and the binary cache of the file is up to date,
+        the already treated columns are memory-mapped from it instead of
+        parsing the CSV. With tamanho_bloco > 0, the CSV is read in chunks of
+        that many rows by ler_csv_em_blocos(). Call preparar() in all cases.
         """
+        self.filename = filename
+        self.usar_cache = usar_cache
+        self.tamanho_bloco = tamanho_bloco
+        self.arquivo_cache = f"{filename}.cache"
+        self.preparado = False
+        self.cache_atualizado = False
+        self.linhas_rejeitadas = {}
+        self.comprimida = False
+
+        if usar_cache and self.ler_cache():
+            self.preparado = True
+            self.cache_atualizado = True
+            print(f"Leitura do cache {self.arquivo_cache} realizada com sucesso!")
+            return
+
         try:
-            self.df = pd.read_csv(filename)
+            if tamanho_bloco > 0:
+                self.ler_csv_em_blocos(tamanho_bloco)
+                self.preparado = True
+            else:
+                self.df = pd.read_csv(filename)
             print(f"Leitura do arquivo {filename} realizada com sucesso!")
         except FileNotFoundError:
             print(f"Erro: Arquivo {filename} não encontrado!")
@@ -40,40 +129,192 @@ class TSPInstance():
             print(f"Erro durante leitura do CSV: {e}")
 
     ###########################################################################
+
+    def preparar(self):
+        """
+        Keeps only the selected columns and maps the categories to integers.
+        With usar_cache, the result is also written to the binary cache.
+        """
+        if not self.preparado:
+            colunas_removidas = [col for col in self.df.columns if col not in COLUNAS_SELECIONADAS]
+            self.df.drop(colunas_removidas, axis=1, inplace=True)
+            self.tratamento_dados()
+            self.preparado = True
+
+        if self.usar_cache and not self.cache_atualizado:
+            self.cache_atualizado = True
+            try:
+                self.gravar_cache()
+            except OSError as e:
+                print(f"Erro ao gravar o cache {self.arquivo_cache}: {e}")
+
+    ###########################################################################
+
+    def ler_csv_em_blocos(self, tamanho_bloco: int):
+        """
+        Reads only the selected columns, tamanho_bloco rows at a time, mapping
+        the categories straight to small integers. Rows with unknown
+        categories, missing values or Flag_Efet outside 0/1 are rejected and
+        counted per column in linhas_rejeitadas.
+        """
+        categoricas = {coluna: str for coluna in CATEGORIAS}
+        partes = {coluna: [] for coluna in COLUNAS_SELECIONADAS}
+        self.linhas_rejeitadas = {coluna: 0 for coluna in COLUNAS_SELECIONADAS}
+        total_rejeitadas = 0
+
+        for bloco in pd.read_csv(self.filename, usecols=COLUNAS_SELECIONADAS, dtype=categoricas, chunksize=tamanho_bloco):
+            colunas = {}
+            for coluna in COLUNAS_SELECIONADAS:
+                if coluna in CATEGORIAS:
+                    colunas[coluna] = bloco[coluna].map(CATEGORIAS[coluna]).to_numpy(dtype=np.float64)
+                else:
+                    colunas[coluna] = pd.to_numeric(bloco[coluna], errors='coerce').to_numpy(dtype=np.float64)
+            colunas['Nivel_Risco_Novo'] = colunas['Nivel_Risco_Novo'] + 1
+
+            validas = np.ones(len(bloco), dtype=bool)
+            for coluna, valores in colunas.items():
+                invalidas = np.isnan(valores)
+                if coluna == 'Flag_Efet':
+                    invalidas |= (valores != 0) & (valores != 1)
+                self.linhas_rejeitadas[coluna] += int(np.count_nonzero(invalidas & validas))
+                validas &= ~invalidas
+            total_rejeitadas += len(bloco) - int(np.count_nonzero(validas))
+
+            for coluna, valores in colunas.items():
+                valores = valores[validas]
+                if coluna in CATEGORIAS or coluna == 'Flag_Efet':
+                    valores = valores.astype(np.int8)
+                partes[coluna].append(valores)
+
+        dados = {}
+        for coluna in COLUNAS_SELECIONADAS:
+            valores = np.concatenate(partes[coluna])
+            partes[coluna] = None
+            dados[coluna] = valores.astype(menor_tipo(valores), copy=False)
+        self.df = pd.DataFrame(dados, copy=False)
+
+        if total_rejeitadas:
+            detalhes = ", ".join(f"{coluna}: {qtd}" for coluna, qtd in self.linhas_rejeitadas.items() if qtd)
+            print(f"Aviso: {total_rejeitadas} linhas rejeitadas ({detalhes})")
+
+    ###########################################################################
+
+    def origem(self) -> dict:
+        info = os.stat(self.filename)
+        return {"tamanho": info.st_size, "mtime_ns": info.st_mtime_ns}
+
+    def leitura(self) -> str:
+        #a leitura em blocos rejeita as linhas inválidas; a inteira as mantém
+        return "blocos" if self.tamanho_bloco > 0 else "inteira"
+
+    def gravar_cache(self):
+        """
+        Writes the treated columns in the smallest integer types, together with
+        the schema, the load mode (see leitura()) and the hash of the source
+        CSV. The file is written to a temporary name and renamed, so
+        concurrent runs never read it half done.
+        """
+        esquema = {"versao": VERSAO_CACHE, "leitura": self.leitura(), "linhas": len(self.df.index), "colunas": []}
+        esquema.update(self.origem())
+        esquema["hash"] = hash_arquivo(self.filename)
+
+        colunas = []
+        deslocamento = 0
+        for nome in self.df.columns:
+            valores = self.df[nome].to_numpy()
+            valores = valores.astype(menor_tipo(valores))
+            colunas.append(valores)
+            esquema["colunas"].append({"nome": nome, "tipo": valores.dtype.str, "deslocamento": deslocamento})
+            deslocamento += -(-valores.nbytes // ALINHAMENTO_CACHE) * ALINHAMENTO_CACHE
+
+        cabecalho = json.dumps(esquema).encode()
+        inicio = len(MAGICO_CACHE) + 8 + len(cabecalho)
+        inicio = -(-inicio // ALINHAMENTO_CACHE) * ALINHAMENTO_CACHE
+
+        temporario = f"{self.arquivo_cache}.{os.getpid()}.tmp"
+        with open(temporario, "wb") as hd:
+            hd.write(MAGICO_CACHE)
+            hd.write(np.uint64(len(cabecalho)).tobytes())
+            hd.write(cabecalho)
+            for coluna, valores in zip(esquema["colunas"], colunas):
+                hd.seek(inicio + coluna["deslocamento"])
+                hd.write(valores.tobytes())
+        os.replace(temporario, self.arquivo_cache)
+
+    def ler_cache(self) -> bool:
+        """
+        Memory-maps the treated columns from the cache. Returns False when the
+        cache does not exist, has another version or load mode or the CSV has
+        changed. When only the modification time of the CSV changed, the
+        header is updated with it, so the next run does not hash it again.
+        """
+        try:
+            with open(self.arquivo_cache, "rb") as hd:
+                if hd.read(len(MAGICO_CACHE)) != MAGICO_CACHE:
+                    return False
+                tamanho = int(np.frombuffer(hd.read(8), dtype=np.uint64)[0])
+                esquema = json.loads(hd.read(tamanho))
+            origem = self.origem()
+        except (OSError, ValueError):
+            return False
+
+        if esquema.get("versao") != VERSAO_CACHE or esquema["leitura"] != self.leitura() or \
+                esquema["tamanho"] != origem["tamanho"]:
+            return False
+        #o CSV pode ter sido copiado ou tocado sem mudar: nesse caso o hash decide
+        if esquema["mtime_ns"] != origem["mtime_ns"]:
+            if esquema["hash"] != hash_arquivo(self.filename):
+                return False
+            esquema["mtime_ns"] = origem["mtime_ns"]
+            self.atualizar_cabecalho(esquema, tamanho)
+
+        inicio = len(MAGICO_CACHE) + 8 + tamanho
+        inicio = -(-inicio // ALINHAMENTO_CACHE) * ALINHAMENTO_CACHE
+        colunas = {}
+        for coluna in esquema["colunas"]:
+            colunas[coluna["nome"]] = np.memmap(self.arquivo_cache, dtype=np.dtype(coluna["tipo"]), mode="r",
+                                                offset=inicio + coluna["deslocamento"], shape=(esquema["linhas"],))
+        self.df = pd.DataFrame(colunas, copy=False)
+        return True
+
+    def atualizar_cabecalho(self, esquema: dict, tamanho: int):
+        #reescreve o cabeçalho no lugar, completado com espaços até o tamanho antigo para não mover as
+        #colunas; se não couber ou não puder ser escrito, o hash é refeito na próxima leitura
+        cabecalho = json.dumps(esquema).encode()
+        if len(cabecalho) > tamanho:
+            return
+        try:
+            with open(self.arquivo_cache, "r+b") as hd:
+                hd.seek(len(MAGICO_CACHE) + 8)
+                hd.write(cabecalho.ljust(tamanho))
+        except OSError:
+            pass
+
+    ###########################################################################
     
+    def comprimir(self) -> int:
+        """
+        Replaces the clients by the distinct rows of the selected columns
+        other than Flag_Efet, with two weight columns: Clientes (how many
+        clients share the row) and Efetivados (how many of them have
+        Flag_Efet = 1). The rows keep the order of their first client, so the
+        Taxa values appear in the same order. Rows with missing values (kept
+        by the whole-file read) are grouped like any other value, so no client
+        is lost. Call it after preparar(); returns the number of clients
+        before the compression.
+        """
+        qtd_clientes = len(self.df.index)
+        colunas = [col for col in COLUNAS_SELECIONADAS if col != 'Flag_Efet']
+        pesos = self.df.groupby(colunas, sort=False, dropna=False)['Flag_Efet'].agg(['size', 'sum'])
+        pesos.columns = ['Clientes', 'Efetivados']
+        self.df = pesos.reset_index()
+        for coluna in ['Clientes', 'Efetivados']:
+            self.df[coluna] = self.df[coluna].astype(menor_tipo(self.df[coluna].to_numpy()))
+        self.comprimida = True
+        return qtd_clientes
+
     def tratamento_dados(self):
-        dict_compr_renda = {
-            "5%-": 1,
-            "5% a 10%": 2,
-            "10% a 15%": 3,
-            "15% a 20%": 4,
-            "20% a 25%": 5,
-            "25% a 30%": 6,
-            "30%+": 7
-        }
-        self.df['Compr_Renda'] = self.df['Compr_Renda'].map(dict_compr_renda)
-
-        dict_nivel_escolaridade = {
-            "Med_e_Sup_Inc": 1,
-            "Sup_e_Pos": 2
-        }
-        self.df['Nivel_Escolaridade'] = self.df['Nivel_Escolaridade'].map(dict_nivel_escolaridade)
-
-        dict_estado_civil = {
-            "Casado": 1,
-            "Divorciado": 2,
-            "Solteiro": 3,
-            "Viuvo": 4
-        }
-        self.df['Estado_Civil'] = self.df['Estado_Civil'].map(dict_estado_civil)
-
-        dict_regiao = {
-            "Centro-Oeste": 1,
-            "Nordeste": 2,
-            "Norte": 3,
-            "Sudeste": 4,
-            "Sul": 5
-        }
-        self.df['Regiao'] = self.df['Regiao'].map(dict_regiao)
+        for coluna, categorias in CATEGORIAS.items():
+            self.df[coluna] = self.df[coluna].map(categorias)
 
         self.df['Nivel_Risco_Novo'] = self.df['Nivel_Risco_Novo'].map(lambda v: v+1)
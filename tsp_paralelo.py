@@ -0,0 +1,204 @@
+###############################################################################
+# tsp_paralelo.py: parallel decoding of populations over a process pool, with
+# the instance arrays kept in shared memory.
+#
+# This code is released under LICENSE.md.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+###############################################################################
+
+from multiprocessing import Pool, shared_memory
+from brkga_mp_ipr.types import BaseChromosome
+from tsp_decoder import TSPDecoder
+import numpy as np
+
+#decoder de cada processo, montado sobre a memória compartilhada
+_decoder_processo = None
+_memorias_processo = []
+
+#último decoder publicado depois do início (ver DecoderPublicado): (nome, decoder, memórias)
+_publicado_processo = (None, None, [])
+
+def _anexar_memoria(descricao: dict, memorias: list = None) -> dict:
+    if memorias is None:
+        memorias = _memorias_processo
+    arrays = {}
+    for nome, (nome_memoria, forma, tipo) in descricao.items():
+        memoria = shared_memory.SharedMemory(name=nome_memoria)
+        memorias.append(memoria)
+        arrays[nome] = np.ndarray(forma, dtype=tipo, buffer=memoria.buf)
+    return arrays
+
+def publicar_estado(decoder: TSPDecoder) -> tuple:
+    """
+    Copia os arrays pré-calculados do decoder para memória compartilhada e
+    devolve (memórias, descrição, escalares); com a descrição e os escalares,
+    anexar_decoder() monta o decoder em outro processo sem copiar a instância.
+    Quem publica deve fechar e remover (unlink) as memórias no fim.
+    """
+    arrays, escalares = decoder.estado()
+    memorias = []
+    descricao = {}
+    for nome, array in arrays.items():
+        memoria = shared_memory.SharedMemory(create=True, size=max(1, array.nbytes))
+        np.ndarray(array.shape, dtype=array.dtype, buffer=memoria.buf)[...] = array
+        memorias.append(memoria)
+        descricao[nome] = (memoria.name, array.shape, array.dtype.str)
+    return memorias, descricao, escalares
+
+def anexar_decoder(descricao: dict, escalares: dict) -> TSPDecoder:
+    return TSPDecoder.de_estado(_anexar_memoria(descricao), escalares)
+
+def _iniciar_processo(descricao: dict, escalares: dict):
+    global _decoder_processo
+    _decoder_processo = anexar_decoder(descricao, escalares)
+
+def _decoder_publicado(publicado: tuple) -> TSPDecoder:
+    #monta o decoder publicado no primeiro pacote dele, soltando o anterior
+    global _publicado_processo
+    nome, descricao, escalares = publicado
+    if _publicado_processo[0] != nome:
+        memorias = _publicado_processo[2]
+        _publicado_processo = (None, None, [])
+        for memoria in memorias:
+            memoria.close()
+        memorias = []
+        decoder = TSPDecoder.de_estado(_anexar_memoria(descricao, memorias), escalares)
+        _publicado_processo = (nome, decoder, memorias)
+    return _publicado_processo[1]
+
+def _avaliar_pacote(pacote) -> np.ndarray:
+    discretos, qtd_genes, publicado = pacote
+    if qtd_genes is not None:
+        discretos = np.unpackbits(discretos, axis=1, count=qtd_genes).view(bool)
+    decoder = _decoder_processo if publicado is None else _decoder_publicado(publicado)
+    return decoder.avaliar_discretos(discretos)
+
+class DecoderParalelo():
+    """
+    Distribui a decodificação de uma população entre processos.
+
+    Os arrays pré-calculados do TSPDecoder são copiados uma única vez para
+    memória compartilhada; cada processo monta o seu decoder sobre eles, sem
+    copiar nem serializar a instância. Os cromossomos são enviados já
+    convertidos por TSPDecoder.discretizar() (os bits, compactados), e os
+    resultados voltam na ordem da população, então o fitness é o mesmo da
+    execução serial.
+    """
+
+    def __init__(self, decoder: TSPDecoder, num_processos: int, cromossomos_por_pacote: int = 0):
+        self.decoder = decoder
+        self.num_processos = num_processos
+        self.cromossomos_por_pacote = cromossomos_por_pacote
+
+        self.memorias, descricao, escalares = publicar_estado(decoder)
+        self.pool = Pool(num_processos, initializer=_iniciar_processo, initargs=(descricao, escalares))
+        self.publicados = 0
+
+    ###########################################################################
+
+    def decode(self, chromosome: BaseChromosome, rewrite: bool) -> float:
+        return self.decoder.decode(chromosome, rewrite)
+
+    def decode_lote(self, cromossomos, rewrite: bool = False) -> np.ndarray:
+        #a reescrita altera os cromossomos da população, então é feita neste processo
+        if rewrite:
+            cromossomos = self.reescrever(cromossomos)
+        return self._distribuir(cromossomos, self.decoder.discretizar)
+
+    def discretizar(self, cromossomos) -> np.ndarray:
+        return self.decoder.discretizar(cromossomos)
+
+    def reescrever(self, cromossomos) -> np.ndarray:
+        return self.decoder.reescrever(cromossomos)
+
+    def avaliar_discretos(self, discretos: np.ndarray) -> np.ndarray:
+        return self._distribuir(discretos, np.asarray)
+
+    def publicar(self, decoder: TSPDecoder) -> 'DecoderPublicado':
+        """
+        Publica outro decoder (por exemplo, o de uma amostra da instância)
+        para os processos já abertos e devolve quem avalia com ele.
+        """
+        self.publicados += 1
+        return DecoderPublicado(self, decoder, f"{id(self)}-{self.publicados}")
+
+    def _distribuir(self, cromossomos, converter, publicado: tuple = None) -> np.ndarray:
+        #pacotes menores que população/processos equilibram melhor a carga
+        tamanho = self.cromossomos_por_pacote or max(1, -(-len(cromossomos) // (4*self.num_processos)))
+        pacotes = (self._empacotar(converter(cromossomos[inicio:inicio+tamanho]), publicado)
+                   for inicio in range(0, len(cromossomos), tamanho))
+        resultados = list(self.pool.imap(_avaliar_pacote, pacotes))
+        if not resultados:
+            return np.empty(0)
+        return np.concatenate(resultados)
+
+    def _empacotar(self, discretos: np.ndarray, publicado: tuple) -> tuple:
+        if discretos.dtype == bool:
+            return np.packbits(discretos, axis=1), discretos.shape[1], publicado
+        return discretos, None, publicado
+
+    ###########################################################################
+
+    def fechar(self):
+        self.pool.close()
+        self.pool.join()
+        for memoria in self.memorias:
+            memoria.close()
+            memoria.unlink()
+        self.memorias = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.fechar()
+
+class DecoderPublicado():
+    """
+    Um TSPDecoder avaliado pelos processos de um DecoderParalelo já aberto,
+    sem abrir outro pool: os arrays vão para memória compartilhada e cada
+    processo monta o decoder no primeiro pacote que recebe dele (e solta o
+    publicado antes). A conversão dos cromossomos é feita neste processo.
+    Com fechar(), a memória compartilhada é removida.
+    """
+
+    def __init__(self, paralelo: DecoderParalelo, decoder: TSPDecoder, nome: str):
+        self.paralelo = paralelo
+        self.decoder = decoder
+        self.memorias, descricao, escalares = publicar_estado(decoder)
+        self.publicado = (nome, descricao, escalares)
+
+    def decode(self, chromosome: BaseChromosome, rewrite: bool) -> float:
+        return self.decoder.decode(chromosome, rewrite)
+
+    def decode_lote(self, cromossomos, rewrite: bool = False) -> np.ndarray:
+        if rewrite:
+            cromossomos = self.reescrever(cromossomos)
+        return self.paralelo._distribuir(cromossomos, self.decoder.discretizar, self.publicado)
+
+    def discretizar(self, cromossomos) -> np.ndarray:
+        return self.decoder.discretizar(cromossomos)
+
+    def reescrever(self, cromossomos) -> np.ndarray:
+        return self.decoder.reescrever(cromossomos)
+
+    def avaliar_discretos(self, discretos: np.ndarray) -> np.ndarray:
+        return self.paralelo._distribuir(discretos, np.asarray, self.publicado)
+
+    def fechar(self):
+        #os processos ainda anexados soltam a memória ao receber o próximo decoder publicado
+        for memoria in self.memorias:
+            memoria.close()
+            memoria.unlink()
+        self.memorias = []
@@ -0,0 +1,93 @@
+###############################################################################
+# tsp_perfil.py: optional per-stage timing of the decoder.
+#
+# This code is released under LICENSE.md.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+###############################################################################
+
+from collections import defaultdict
+from contextlib import contextmanager, nullcontext
+import os
+import time
+import tracemalloc
+
+#variável de ambiente que liga o perfil sem mudar a linha de comando; com o valor VALOR_MEMORIA,
+#mede também a memória
+VARIAVEL_PERFIL = "TSP_PERFIL"
+VALOR_MEMORIA = "memoria"
+
+def perfil_ativo() -> bool:
+    return os.environ.get(VARIAVEL_PERFIL, "") not in ("", "0")
+
+def perfil_memoria() -> bool:
+    return os.environ.get(VARIAVEL_PERFIL, "") == VALOR_MEMORIA
+
+class PerfilDesligado():
+    """
+    Perfil padrão do decoder: não mede nada e devolve sempre o mesmo contexto
+    vazio, então não aloca nem chama relógio.
+    """
+
+    _nada = nullcontext()
+
+    def etapa(self, nome: str):
+        return self._nada
+
+PERFIL_DESLIGADO = PerfilDesligado()
+
+class Perfil():
+    """
+    Acumula, para cada etapa do decoder, o tempo gasto e o número de chamadas.
+    Com memoria=True, guarda também o maior pico de memória acima do início
+    da etapa, medido com tracemalloc (que acompanha os buffers do NumPy).
+    O tracemalloc rastreia toda alocação do processo e deixa a execução
+    várias vezes mais lenta, então só é ligado quando pedido.
+    """
+
+    def __init__(self, memoria: bool = False):
+        self.memoria = memoria
+        self.tempos = defaultdict(float)
+        self.chamadas = defaultdict(int)
+        self.picos = defaultdict(int)
+        if memoria and not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+    @contextmanager
+    def etapa(self, nome: str):
+        if self.memoria:
+            memoria_inicial = tracemalloc.get_traced_memory()[0]
+            tracemalloc.reset_peak()
+        inicio = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.tempos[nome] += time.perf_counter() - inicio
+            self.chamadas[nome] += 1
+            if self.memoria:
+                pico = tracemalloc.get_traced_memory()[1] - memoria_inicial
+                self.picos[nome] = max(self.picos[nome], pico)
+
+    def tabela(self) -> str:
+        total = sum(self.tempos.values()) or 1.0
+        cabecalho = f"{'Stage':<20} {'Calls':>10} {'Time (s)':>10} {'%':>6} {'ms/call':>9}"
+        if self.memoria:
+            cabecalho += f" {'Peak delta MB':>14}"
+        linhas = [cabecalho]
+        for nome, tempo in sorted(self.tempos.items(), key=lambda item: -item[1]):
+            chamadas = self.chamadas[nome]
+            linha = f"{nome:<20} {chamadas:>10} {tempo:>10.3f} {100*tempo/total:>6.1f} {1000*tempo/chamadas:>9.3f}"
+            if self.memoria:
+                linha += f" {self.picos[nome]/2**20:>14.2f}"
+            linhas.append(linha)
+        return "\n".join(linhas)
@@ -0,0 +1,95 @@
+###############################################################################
+# tsp_telemetria.py: convergence telemetry, appended as JSON lines by a
+# background thread while the evolution runs.
+#
+# This code is released under LICENSE.md.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+###############################################################################
+
+import json
+import queue
+import threading
+import time
+
+#tamanho do buffer do arquivo; a thread só força a escrita quando a fila esvazia
+BUFFER_TELEMETRIA = 2**16
+
+class Telemetria():
+    """
+    Acrescenta registros (dicionários) a um arquivo, um JSON por linha.
+    registrar() só põe o registro numa fila: uma thread o serializa e o
+    escreve com buffer, descarregando o arquivo quando não há mais nada na
+    fila, então a evolução não espera pelo disco e as linhas aparecem logo.
+    O arquivo não é truncado, para que uma execução continuada com --resume
+    acrescente ao que já foi gravado.
+    """
+
+    def __init__(self, filename: str):
+        self.arquivo = open(filename, "a", buffering=BUFFER_TELEMETRIA)
+        self.fila = queue.Queue()
+        self.thread = threading.Thread(target=self._escrever, daemon=True)
+        self.thread.start()
+
+    def _escrever(self):
+        while True:
+            registro = self.fila.get()
+            if registro is None:
+                break
+            self.arquivo.write(json.dumps(registro) + "\n")
+            if self.fila.empty():
+                self.arquivo.flush()
+        self.arquivo.close()
+
+    def registrar(self, registro: dict) -> None:
+        self.fila.put(registro)
+
+    def fechar(self):
+        #escreve o que ainda está na fila antes de fechar o arquivo
+        if self.thread.is_alive():
+            self.fila.put(None)
+            self.thread.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.fechar()
+
+class Eventos():
+    """
+    Conta e cronometra os eventos (troca de elite, reinício) acontecidos
+    entre dois registros da telemetria.
+    """
+
+    NOMES = ["troca", "reinicio"]
+
+    def __init__(self):
+        self.zerar()
+
+    def zerar(self):
+        self.quantidade = {nome: 0 for nome in self.NOMES}
+        self.tempo = {nome: 0.0 for nome in self.NOMES}
+
+    def medir(self, nome: str, funcao, *args):
+        inicio = time.perf_counter()
+        funcao(*args)
+        self.quantidade[nome] += 1
+        self.tempo[nome] += time.perf_counter() - inicio
+
+    def resumo(self) -> dict:
+        resumo = {}
+        for nome in self.NOMES:
+            resumo[f"{nome}s"] = self.quantidade[nome]
+            resumo[f"tempo_{nome}s_s"] = self.tempo[nome]
+        return resumo
@@ -0,0 +1,292 @@
+###############################################################################
+# varredura.py: runs a grid of seeds, parameter values and generation budgets
+#               over one instance load, on a pool of worker processes.
+#
+# This code is released under LICENSE.md.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+###############################################################################
+
+from multiprocessing import Pool
+import copy
+import csv
+import itertools
+import sys
+import time
+
+import docopt
+
+from brkga_mp_ipr.enums import Sense
+from brkga_mp_ipr.exceptions import LoadError
+
+from tsp_instance import TSPInstance
+from tsp_decoder import TSPDecoder, CODIFICACOES, TIPOS_GENE
+from tsp_brkga import BrkgaMpIprLote
+from tsp_config import carregar_configuracao, aplicar_parametro
+from tsp_heuristica import gerar_cromossomos
+from tsp_paralelo import publicar_estado, anexar_decoder
+from tsp_cache import CacheFitness
+
+###############################################################################
+
+USAGE = """
+Usage:
+  varredura.py <config-file> <tsp-instance-file> [--sementes=<lista>]
+               [--geracoes=<lista>] [--variar=<parametro>]...
+               [--processos=<n>] [--saida=<arquivo>]
+  varredura.py (-h | --help)
+
+Options:
+  --sementes=<lista>     Seeds of the runs [default: 1].
+  --geracoes=<lista>     Generation budgets. Each run evolves up to the largest
+                         one and reports the best solution at every budget,
+                         which is the same as separate runs with the same seed
+                         [default: 100].
+  --variar=<parametro>   Values of one parameter of <config-file>, as
+                         name=v1,v2,... (for instance population_size=500,1000
+                         or qtd_grupos=2,4). Repeat it to vary several
+                         parameters; every combination is run.
+  --processos=<n>        Runs executed at the same time [default: 1].
+  --saida=<arquivo>      CSV file with one line per run and generation budget
+                         [default: varredura.csv].
+  -h --help              Show this screen.
+
+The instance is read and treated once, and one decoder is built for each
+combination of qtd_grupos, codificacao and comprimir_clientes; the workers
+read the decoders from shared memory. Each run decodes serially and runs for
+the whole generation budget on the whole base, so num_processos, ilhas, the
+stopping criteria, the sampling, the checkpoints, the telemetry and the
+incremental evaluation of <config-file> are ignored and cannot be varied.
+exchange_interval, reset_interval and num_exchange_indivuduals only apply,
+and can only be varied, with controle_populacoes 1.
+"""
+
+#parâmetros que mudam o decoder; os demais só mudam a execução do BRKGA
+PARAMETROS_DECODER = ['qtd_grupos', 'codificacao', 'comprimir_clientes']
+
+#parâmetros que a varredura não aplica às execuções
+PARAMETROS_IGNORADOS = ['num_processos', 'cache_instancia', 'tamanho_bloco_csv', 'ilhas',
+                        'intervalo_checkpoint', 'arquivo_checkpoint', 'tempo_maximo',
+                        'geracoes_sem_melhora', 'fitness_alvo', 'amostra_inicial',
+                        'geracoes_por_amostra', 'amostra_sem_melhora',
+                        'intervalo_telemetria', 'arquivo_telemetria', 'avaliacao_incremental']
+
+#parâmetros de controle, aplicados só com controle_populacoes
+PARAMETROS_CONTROLE = ['exchange_interval', 'reset_interval', 'num_exchange_indivuduals']
+
+###############################################################################
+
+#configuração base e decoders publicados, recebidos por cada processo
+_configuracao_processo = None
+_variantes_processo = {}
+_decoders_processo = {}
+
+def _iniciar_processo(configuracao: tuple, variantes: dict):
+    global _configuracao_processo, _variantes_processo
+    _configuracao_processo = configuracao
+    _variantes_processo = variantes
+
+def _decoder_variante(variante: tuple) -> TSPDecoder:
+    #cada processo monta o decoder de uma variante só na primeira vez que precisa dele
+    if variante not in _decoders_processo:
+        descricao, escalares = _variantes_processo[variante]
+        _decoders_processo[variante] = anexar_decoder(descricao, escalares)
+    return _decoders_processo[variante]
+
+def variante_decoder(parametros) -> tuple:
+    return tuple(getattr(parametros, nome) for nome in PARAMETROS_DECODER)
+
+def configurar(configuracao: tuple, valores: dict) -> tuple:
+    configuracao = copy.deepcopy(configuracao)
+    for nome, valor in valores.items():
+        aplicar_parametro(configuracao, nome, valor)
+    return configuracao
+
+def executar(tarefa: tuple) -> list:
+    """
+    Executa uma combinação (semente e valores dos parâmetros) até o maior
+    orçamento de gerações e devolve uma linha de resultado por orçamento.
+    """
+    indice, semente, valores, orcamentos = tarefa
+    brkga_params, control_params, parametros = configurar(_configuracao_processo, valores)
+
+    decoder = _decoder_variante(variante_decoder(parametros))
+    tamanho_cromossomo = decoder.tamanho_cromossomo
+    iniciais = []
+    quantidade_inicial = int(parametros.fracao_heuristica * brkga_params.population_size)
+    if quantidade_inicial > 0:
+        iniciais = gerar_cromossomos(decoder, quantidade_inicial, semente)
+    if parametros.cache_fitness_mb > 0:
+        decoder = CacheFitness(decoder, parametros.cache_fitness_mb)
+
+    inicio = time.perf_counter()
+    brkga = BrkgaMpIprLote(
+        decoder=decoder,
+        sense=Sense.MINIMIZE,
+        seed=semente,
+        chromosome_size=tamanho_cromossomo,
+        params=brkga_params,
+        reescrever=parametros.reparar,
+        armazenamento=parametros.armazenamento_populacao
+    )
+    if iniciais:
+        brkga.set_initial_population(iniciais)
+    brkga.initialize()
+    melhor = brkga.get_best_fitness()
+    geracao_melhor = 0
+    tempo_melhor = time.perf_counter() - inicio
+
+    linhas = []
+    inicio_evolucao = time.perf_counter()
+    for geracao in range(1, max(orcamentos) + 1):
+        brkga.evolve(1)
+        if parametros.controle_populacoes:
+            brkga.controlar(geracao, control_params)
+        valor = brkga.get_best_fitness()
+        if valor < melhor:
+            melhor = valor
+            geracao_melhor = geracao
+            tempo_melhor = time.perf_counter() - inicio
+
+        if geracao in orcamentos:
+            agora = time.perf_counter()
+            linhas.append({
+                "execucao": indice,
+                "semente": semente,
+                **valores,
+                "geracoes": geracao,
+                "melhor_fitness": melhor,
+                "geracao_do_melhor": geracao_melhor,
+                "tempo_ate_melhor_s": round(tempo_melhor, 4),
+                "tempo_total_s": round(agora - inicio, 4),
+                "geracoes_por_s": round(geracao / (agora - inicio_evolucao), 4),
+            })
+    return linhas
+
+###############################################################################
+
+def ler_grade(especificacoes: list) -> dict:
+    grade = {}
+    for especificacao in especificacoes:
+        nome, separador, valores = especificacao.partition("=")
+        if not separador or not valores:
+            raise LoadError(f"invalid grid '{especificacao}' (use name=v1,v2,...)")
+        nome = nome.strip().lower()
+        if nome in PARAMETROS_IGNORADOS:
+            raise LoadError(f"'{nome}' is not applied by the sweep and cannot be varied")
+        grade[nome] = [valor.strip() for valor in valores.split(",")]
+    return grade
+
+def main() -> None:
+    args = docopt.docopt(USAGE)
+
+    sementes = [int(valor) for valor in args["--sementes"].split(",")]
+    orcamentos = sorted({int(valor) for valor in args["--geracoes"].split(",")})
+    num_processos = int(args["--processos"])
+
+    ########################################
+    # Read the parameters and build the grid
+    ########################################
+
+    print("Reading parameters...")
+    try:
+        configuracao = carregar_configuracao(args["<config-file>"])
+        grade = ler_grade(args["--variar"])
+        combinacoes = [dict(zip(grade, valores)) for valores in itertools.product(*grade.values())]
+        configuracoes = [configurar(configuracao, valores) for valores in combinacoes]
+    except LoadError as e:
+        print(f"Error: {e}")
+        sys.exit(1)
+    variados = [nome for nome in grade if nome in PARAMETROS_CONTROLE]
+    if variados and not all(parametros.controle_populacoes for _, _, parametros in configuracoes):
+        print(f"Error: varying {', '.join(variados)} requires controle_populacoes 1")
+        sys.exit(1)
+    if min(orcamentos) < 1:
+        print("Error: generation budgets must be positive")
+        sys.exit(1)
+    for _, _, parametros in configuracoes:
+        if parametros.codificacao not in CODIFICACOES:
+            print(f"Unknown encoding: {parametros.codificacao} "
+                  f"(use {', '.join(CODIFICACOES)})")
+            sys.exit(1)
+        if parametros.armazenamento_populacao not in TIPOS_GENE:
+            print(f"Unknown population storage: {parametros.armazenamento_populacao} "
+                  f"(use {', '.join(TIPOS_GENE)})")
+            sys.exit(1)
+
+    ########################################
+    # Read the instance once and build one decoder per variant
+    ########################################
+
+    parametros = configuracao[2]
+    print("Reading data...")
+    instance = TSPInstance(args["<tsp-instance-file>"], usar_cache=parametros.cache_instancia,
+                           tamanho_bloco=parametros.tamanho_bloco_csv)
+    instance.preparar()
+
+    instancia_comprimida = None
+    memorias = []
+    variantes = {}
+    try:
+        for _, _, parametros in configuracoes:
+            variante = variante_decoder(parametros)
+            if variante in variantes:
+                continue
+            qtd_grupos, codificacao, comprimir_clientes = variante
+            origem = instance
+            if comprimir_clientes:
+                if instancia_comprimida is None:
+                    instancia_comprimida = copy.copy(instance)
+                    instancia_comprimida.comprimir()
+                origem = instancia_comprimida
+            print(f"Building decoder: {qtd_grupos} groups, {codificacao}"
+                  f"{', compressed' if comprimir_clientes else ''}...")
+            memorias_variante, descricao, escalares = publicar_estado(
+                TSPDecoder(origem, qtd_grupos, 5, codificacao=codificacao))
+            memorias.extend(memorias_variante)
+            variantes[variante] = (descricao, escalares)
+
+        ########################################
+        # Run the grid
+        ########################################
+
+        tarefas = [(indice, semente, valores, orcamentos)
+                   for indice, (semente, valores) in enumerate(itertools.product(sementes, combinacoes))]
+        print(f"Running {len(tarefas)} runs on {num_processos} processes...")
+
+        campos = None
+        with open(args["--saida"], "w", newline="") as hd, \
+             Pool(num_processos, initializer=_iniciar_processo, initargs=(configuracao, variantes)) as pool:
+            for linhas in pool.imap(executar, tarefas):
+                if campos is None:
+                    campos = list(linhas[0].keys())
+                    escritor = csv.DictWriter(hd, fieldnames=campos)
+                    escritor.writeheader()
+                escritor.writerows(linhas)
+                hd.flush()
+
+                final = linhas[-1]
+                print(f"  run {final['execucao']}: seed {final['semente']}, "
+                      f"best {final['melhor_fitness']} at generation {final['geracao_do_melhor']}, "
+                      f"{final['geracoes_por_s']:.2f} generations/s")
+    finally:
+        for memoria in memorias:
+            memoria.close()
+            memoria.unlink()
+
+    print(f"Results written to {args['--saida']}")
+
+###############################################################################
+
+if __name__ == "__main__":
+    main()